@@ -0,0 +1,13 @@
+from .extractor import ExtractorPool
+from .streams import Stream, StreamCache
+from .youtube import YouTubeAPI, LocalYouTube
+from .metadata import MetadataBatcher, snippetInfo, trackInfo
+from .searches import SearchCache
+from .tracks import Track, TrackQueue
+from .player import GuildPlayer
+from .sources import SourceFactory
+from .diskcache import AudioCache
+from .scheduler import ResolveScheduler
+from .timers import TimerWheel
+from .snapshots import QueueSnapshots
+from .workers import AudioWorkerPool, WorkerAudio
@@ -0,0 +1,203 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+from .extractor import ExtractorPool
+
+# Plays within one session after which a track is downloaded into the cache
+AUDIO_CACHE_ADMIT_PLAYS = 2
+# Number of concurrent downloads
+AUDIO_CACHE_WORKERS = 1
+# Seconds before a download is abandoned
+AUDIO_CACHE_TIMEOUT = 600
+# Number of uncached tracks whose play counts are remembered
+AUDIO_CACHE_CANDIDATES = 10000
+# Names of the files yt-dlp writes for a download: "<video id>.<ext>", the intermediate
+# "<video id>.temp.<ext>" of the audio conversion, and the ".part", ".part-Frag<n>" and
+# ".ytdl" files of an unfinished download
+AUDIO_CACHE_FILE = re.compile(r"([A-Za-z0-9_-]{11})(\.temp)?\.[A-Za-z0-9]+(\.part(-Frag\d+)?|\.ytdl)?")
+
+
+class CachedAudio:
+    __slots__ = ("path", "size", "plays", "last_played")
+
+    def __init__(self, path: str, size: int, plays: int, last_played: float) -> None:
+        self.path = path
+        self.size = size
+        self.plays = plays
+        self.last_played = last_played
+
+
+class AudioCache:
+    def __init__(self, directory: str, maxBytes: int, storage, options: dict, admitPlays: int = AUDIO_CACHE_ADMIT_PLAYS, scheduler=None) -> None:
+        """
+        Size-capped directory of Opus files for frequently played tracks.
+
+        Tracks played admitPlays times are downloaded in the background. The audio_cache
+        table indexes the files by video id and is mirrored in memory, so checking for a
+        local copy costs a dictionary lookup. Once the directory grows past maxBytes the
+        least recently played files are deleted. Files named like a download that are not
+        indexed, left behind by failed or timed out downloads, are deleted on load and after
+        every download; other files in the directory are never touched.
+
+        Args:
+            directory (str): Directory holding the audio files.
+            maxBytes (int): Maximum total size of the cached files.
+            storage (database.Storage): Storage holding the index.
+            options (dict): Options passed to YoutubeDL; outtmpl and postprocessors are replaced.
+            admitPlays (int, optional): Plays after which a track is downloaded.
+            scheduler (ResolveScheduler, optional): Admits downloads as background resolves of the guild that played the track.
+        """
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.storage = storage
+        self.admitPlays = admitPlays
+        self.scheduler = scheduler
+        # Taken before asking the scheduler, so downloads waiting for a downloader thread hold no resolve slot
+        self.downloadSlots = asyncio.Semaphore(AUDIO_CACHE_WORKERS)
+        self.downloader = ExtractorPool({
+            **options,
+            'format': 'bestaudio[acodec=opus]/bestaudio',
+            'outtmpl': os.path.join(directory, '%(id)s.%(ext)s'),
+            # Remuxes Opus into an .opus file; other codecs are converted once here instead of on every play
+            'postprocessors': [{'key': 'FFmpegExtractAudio', 'preferredcodec': 'opus'}],
+        }, AUDIO_CACHE_WORKERS, AUDIO_CACHE_TIMEOUT, download=True)
+        # Video ID -> CachedAudio
+        self.files = {}
+        self.size = 0
+        # Video ID -> plays, for tracks that are not cached yet
+        self.candidates = OrderedDict()
+        # Video ID -> download task
+        self.downloads = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.strays = 0
+
+    async def load(self) -> None:
+        """
+        Reads the index, dropping entries whose files have disappeared and files that are not indexed.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        missing = []
+        for video_id, path, size, plays, last_played in await self.storage.fetchall(
+                "SELECT video_id, path, size, plays, last_played FROM audio_cache"):
+            if os.path.exists(path):
+                self.files[video_id] = CachedAudio(path, size, plays, last_played)
+                self.size += size
+            else:
+                missing.append((video_id,))
+        if missing:
+            await self.storage.executemany("DELETE FROM audio_cache WHERE video_id = ?", missing)
+        self._sweep()
+        await self._evict()
+
+    def lookup(self, video_id: str) -> str:
+        """
+        Returns the path of a cached track, or None.
+        """
+        entry = self.files.get(video_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry.path
+
+    async def recordPlay(self, video_id: str, guild_id: int = None) -> None:
+        """
+        Counts a play, downloading the track in the background once it has been played often enough.
+        """
+        now = time.time()
+        entry = self.files.get(video_id)
+        if entry is not None:
+            entry.plays += 1
+            entry.last_played = now
+            await self.storage.execute("UPDATE audio_cache SET plays = ?, last_played = ? WHERE video_id = ?",
+                                       (entry.plays, now, video_id))
+            return
+        plays = self.candidates.pop(video_id, 0) + 1
+        if plays < self.admitPlays:
+            self.candidates[video_id] = plays
+            while len(self.candidates) > AUDIO_CACHE_CANDIDATES:
+                self.candidates.popitem(last=False)
+        elif video_id not in self.downloads:
+            self.downloads[video_id] = asyncio.create_task(
+                self._download(video_id, plays, guild_id))
+
+    def close(self) -> None:
+        for task in self.downloads.values():
+            task.cancel()
+        self.downloader.close()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached tracks": len(self.files),
+            "audio cache (MB)": round(self.size / 2**20, 1),
+            "audio cache hit rate": f"{self.hits / lookups:.1%}" if lookups else "-",
+            "audio cache downloads": len(self.downloads),
+            "audio cache evictions": self.evictions,
+            "audio cache strays removed": self.strays,
+        }
+
+    async def _download(self, video_id: str, plays: int, guild_id: int) -> None:
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        try:
+            async with self.downloadSlots:
+                if self.scheduler is not None:
+                    info = await self.scheduler.run(guild_id, lambda: self.downloader.extract(url))
+                else:
+                    info = await self.downloader.extract(url)
+            downloads = info.get('requested_downloads') or [{}]
+            path = downloads[0].get('filepath') or os.path.join(
+                self.directory, f"{video_id}.opus")
+            size = os.path.getsize(path)
+            self.files[video_id] = CachedAudio(path, size, plays, time.time())
+            self.size += size
+            await self.storage.execute("INSERT OR REPLACE INTO audio_cache (video_id, path, size, plays, last_played) VALUES (?, ?, ?, ?, ?)",
+                                       (video_id, path, size, plays, time.time()))
+            await self._evict()
+        except Exception as e:
+            print(f"Could not cache {video_id}: {e}")
+        finally:
+            self.downloads.pop(video_id, None)
+            # Removes the partial files of a failed download, and the files of timed out
+            # downloads that kept running in the background and finished since
+            self._sweep()
+
+    def _sweep(self) -> None:
+        """
+        Deletes the download files in the directory that are neither indexed nor being downloaded.
+        """
+        indexed = {os.path.abspath(entry.path) for entry in self.files.values()}
+        for name in os.listdir(self.directory):
+            match = AUDIO_CACHE_FILE.fullmatch(name)
+            # Files the cache did not write, e.g. when the directory is shared, are left alone
+            if match is None or match.group(1) in self.downloads:
+                continue
+            path = os.path.abspath(os.path.join(self.directory, name))
+            if path in indexed or not os.path.isfile(path):
+                continue
+            try:
+                os.remove(path)
+                self.strays += 1
+            except OSError as e:
+                print(e)
+
+    async def _evict(self) -> None:
+        if self.size <= self.maxBytes:
+            return
+        evicted = []
+        for video_id, entry in sorted(self.files.items(), key=lambda item: item[1].last_played):
+            if self.size <= self.maxBytes:
+                break
+            del self.files[video_id]
+            self.size -= entry.size
+            evicted.append((video_id,))
+            try:
+                os.remove(entry.path)
+            except OSError as e:
+                print(e)
+        self.evictions += len(evicted)
+        await self.storage.executemany("DELETE FROM audio_cache WHERE video_id = ?", evicted)
@@ -0,0 +1,131 @@
+"""
+Audio worker process, started by AudioWorkerPool as a script.
+
+Runs FFmpeg, Ogg demuxing and, for PCM sources, Opus encoding for the sessions the bot
+opens on it, one thread per session. Commands arrive as pickled tuples on stdin:
+
+    ("open", session_id, kind, source, before_options, options, credits)
+    ("credit", session_id, batches)
+    ("close", session_id)
+
+Frames go back on stdout as (session_id, frames, done, error) tuples holding up to
+FRAME_BATCH Opus frames. A session only sends a batch when it holds a credit, and the
+bot returns one credit per batch played, so a session never runs further ahead of
+playback than the credits it was opened with.
+
+Only the standard library and discord.py are imported here, so starting a worker does
+not load the rest of the bot.
+"""
+import os
+import threading
+from multiprocessing.connection import Connection
+import discord
+
+# Opus frames (20 ms each) per message sent to the bot
+FRAME_BATCH = 10
+# Session kinds: copied Opus, Opus transcoded by FFmpeg, and PCM encoded with libopus here
+SESSION_KINDS = ("copy", "transcode", "pcm")
+# Niceness added to the worker; frames are buffered seconds ahead, packet sending is not
+WORKER_NICE = 10
+
+
+class Session(threading.Thread):
+    def __init__(self, session_id: int, kind: str, source: str, before_options: str, options: str, output, credits: int) -> None:
+        super().__init__(name=f"session-{session_id}", daemon=True)
+        self.session_id = session_id
+        self.kind = kind
+        self.source = source
+        self.before_options = before_options
+        self.options = options
+        self.output = output
+        self.credits = threading.Semaphore(credits)
+        self.stopped = threading.Event()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        # Wake the session if it is waiting for a credit
+        self.credits.release()
+
+    def run(self) -> None:
+        frames = []
+        error = None
+        audio = None
+        try:
+            audio, opusEncoder = self._open()
+            while not self.stopped.is_set():
+                frame = audio.read()
+                if not frame:
+                    break
+                if opusEncoder is not None:
+                    frame = opusEncoder.encode(frame, opusEncoder.SAMPLES_PER_FRAME)
+                frames.append(frame)
+                if len(frames) >= FRAME_BATCH:
+                    self.credits.acquire()
+                    if self.stopped.is_set():
+                        break
+                    self.output.send(self.session_id, frames, False, None)
+                    frames = []
+        except Exception as e:
+            error = str(e)
+        finally:
+            if audio is not None:
+                audio.cleanup()
+        if not self.stopped.is_set():
+            self.output.send(self.session_id, frames, True, error)
+
+    def _open(self):
+        if self.kind == "pcm":
+            return discord.FFmpegPCMAudio(self.source, before_options=self.before_options, options=self.options), discord.opus.Encoder()
+        codec = "opus" if self.kind == "copy" else None
+        return discord.FFmpegOpusAudio(self.source, codec=codec, before_options=self.before_options, options=self.options), None
+
+
+class Output:
+    def __init__(self, connection: Connection) -> None:
+        # Sessions send from their own threads
+        self.connection = connection
+        self.lock = threading.Lock()
+
+    def send(self, session_id: int, frames: list, done: bool, error: str) -> None:
+        with self.lock:
+            try:
+                self.connection.send((session_id, frames, done, error))
+            except OSError:
+                # The bot is gone; the control loop sees EOF and exits
+                pass
+
+
+def main() -> None:
+    if hasattr(os, "nice"):
+        os.nice(WORKER_NICE)
+    output = Output(Connection(os.dup(1), readable=False))
+    # Keep stdout for frames, anything printed goes to stderr
+    os.dup2(2, 1)
+    control = Connection(os.dup(0), writable=False)
+    sessions = {}
+    while True:
+        try:
+            command, session_id, *args = control.recv()
+        except EOFError:
+            break
+        if command == "open":
+            kind, source, before_options, options, credits = args
+            session = sessions[session_id] = Session(
+                session_id, kind, source, before_options, options, output, credits)
+            session.start()
+        elif command == "credit":
+            session = sessions.get(session_id)
+            if session is not None:
+                session.credits.release(args[0])
+        elif command == "close":
+            session = sessions.pop(session_id, None)
+            if session is not None:
+                session.stop()
+    for session in sessions.values():
+        session.stop()
+    for session in sessions.values():
+        session.join(5)
+
+
+if __name__ == "__main__":
+    main()
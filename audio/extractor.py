@@ -0,0 +1,67 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from yt_dlp import YoutubeDL
+
+# Number of threads running yt-dlp extractions
+EXTRACTOR_WORKERS = 4
+# Seconds before an extraction is abandoned
+EXTRACT_TIMEOUT = 20
+
+
+class ExtractorPool:
+    def __init__(self, options: dict, workers: int = EXTRACTOR_WORKERS, timeout: float = EXTRACT_TIMEOUT, download: bool = False) -> None:
+        """
+        Runs yt-dlp extractions on a bounded thread pool.
+
+        YoutubeDL instances are not thread safe, so every worker thread builds one on its
+        first extraction and keeps reusing it afterwards.
+
+        Args:
+            options (dict): Options passed to YoutubeDL.
+            workers (int, optional): Maximum number of concurrent extractions.
+            timeout (float, optional): Default seconds to wait for an extraction.
+            download (bool, optional): Whether extractions also download the media.
+        """
+        self.options = options
+        self.timeout = timeout
+        self.download = download
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="yt-dlp")
+        self.extractions = 0
+        self.failures = 0
+
+    async def extract(self, url: str, timeout: float = None) -> dict:
+        """
+        Extracts the info dict of a URL, downloading it only if the pool was created with download=True.
+
+        Cancelling the awaiting task, or hitting the timeout, drops the extraction if it
+        has not started yet; a running one finishes in the background and is discarded.
+
+        Raises:
+            asyncio.TimeoutError: The extraction took longer than timeout.
+            yt_dlp.utils.DownloadError: yt-dlp could not extract the URL.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, self._extract, url), timeout or self.timeout)
+        except Exception:
+            self.failures += 1
+            raise
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "extractions": self.extractions,
+            "extraction failures": self.failures,
+        }
+
+    def _extract(self, url: str) -> dict:
+        ydl = getattr(self._local, "ydl", None)
+        if ydl is None:
+            ydl = self._local.ydl = YoutubeDL(self.options)
+        self.extractions += 1
+        return ydl.extract_info(url, download=self.download)
@@ -0,0 +1,179 @@
+import asyncio
+import html
+from collections import OrderedDict
+
+# Maximum number of video IDs accepted by one videos.list request
+METADATA_BATCH_SIZE = 50
+# Seconds pending lookups are collected before a request is sent
+METADATA_BATCH_WINDOW = 0.05
+# Number of video metadata entries kept in memory
+METADATA_CACHE_SIZE = 4096
+
+
+def snippetInfo(video_id: str, snippet: dict) -> dict:
+    """
+    Returns the song metadata held in a search, video or playlist item snippet.
+    """
+    return {
+        "video_id": video_id,
+        # search.list returns HTML-escaped titles
+        "title": html.unescape(snippet['title']),
+        "artist": snippet.get('videoOwnerChannelTitle') or snippet['channelTitle'],
+        "thumbnail": snippet['thumbnails']['default']['url'],
+    }
+
+
+def trackInfo(video_id: str, title: str, artist: str) -> dict:
+    """
+    Returns the song metadata of a video saved in the database.
+    """
+    return {
+        "video_id": video_id,
+        "title": title,
+        "artist": artist,
+        "thumbnail": f"https://i.ytimg.com/vi/{video_id}/default.jpg",
+    }
+
+
+class MetadataBatcher:
+    def __init__(self, youtube, window: float = METADATA_BATCH_WINDOW, batchSize: int = METADATA_BATCH_SIZE, maxSize: int = METADATA_CACHE_SIZE, storage=None, scheduler=None) -> None:
+        """
+        Looks up video metadata with combined videos.list requests.
+
+        Lookups arriving within window seconds of each other are sent together, up to
+        batchSize IDs per request, and every waiting caller gets its own entry back.
+        Snippets already returned by searches and playlist pages can be stored with
+        prime() so those videos cost no request at all, and with storage, videos saved
+        in music queue snapshots are read from the database before asking YouTube.
+        With a scheduler, requests wait for a background resolve slot. A batch mixes the
+        videos of several guilds, so batches take their turn as guild None.
+
+        Args:
+            youtube (YouTubeAPI): The client issuing videos.list requests.
+            window (float, optional): Seconds lookups are collected before sending.
+            batchSize (int, optional): Maximum number of IDs per request.
+            maxSize (int, optional): Maximum number of cached entries.
+            storage (database.Storage, optional): Storage holding saved track metadata.
+            scheduler (ResolveScheduler, optional): Admission control for the requests.
+        """
+        self.youtube = youtube
+        self.storage = storage
+        self.scheduler = scheduler
+        self.window = window
+        self.batchSize = batchSize
+        self.maxSize = maxSize
+        # Video ID -> metadata dict, or None for unavailable videos
+        self.entries = OrderedDict()
+        # Video ID -> future waiting for the next request
+        self.pending = {}
+        self._flushHandle = None
+        # Running requests; the event loop only keeps weak references to tasks
+        self.requests = set()
+        self.lookups = 0
+        self.hits = 0
+        self.storageHits = 0
+        self.batches = 0
+
+    async def get(self, video_id: str) -> dict:
+        """
+        Returns the metadata of a video, or None if YouTube does not return it.
+
+        Raises:
+            googleapiclient.errors.HttpError: The videos.list request failed.
+        """
+        self.lookups += 1
+        if video_id in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(video_id)
+            return self.entries[video_id]
+        future = self.pending.get(video_id)
+        if future is None:
+            future = self.pending[video_id] = asyncio.get_running_loop().create_future()
+            if len(self.pending) >= self.batchSize:
+                self._flush()
+            elif self._flushHandle is None:
+                self._flushHandle = asyncio.get_running_loop().call_later(self.window, self._flush)
+        # Shielded so one caller giving up does not fail the lookup for the others
+        return await asyncio.shield(future)
+
+    async def getMany(self, video_ids: list) -> list:
+        """
+        Returns the metadata of several videos, in order, with None for unavailable ones.
+        """
+        return await asyncio.gather(*(self.get(video_id) for video_id in video_ids))
+
+    def prime(self, info: dict) -> None:
+        """
+        Caches metadata obtained from another API response.
+        """
+        self._store(info['video_id'], info)
+
+    def stats(self) -> dict:
+        return {
+            "metadata lookups": self.lookups,
+            "metadata hits": self.hits,
+            "metadata database hits": self.storageHits,
+            "metadata requests": self.batches,
+        }
+
+    def _store(self, video_id: str, info: dict) -> None:
+        self.entries[video_id] = info
+        self.entries.move_to_end(video_id)
+        while len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def _flush(self) -> None:
+        if self._flushHandle is not None:
+            self._flushHandle.cancel()
+            self._flushHandle = None
+        while self.pending:
+            batch = {}
+            for video_id in list(self.pending)[:self.batchSize]:
+                batch[video_id] = self.pending.pop(video_id)
+            task = asyncio.create_task(self._request(batch))
+            self.requests.add(task)
+            task.add_done_callback(self.requests.discard)
+
+    async def _request(self, batch: dict) -> None:
+        try:
+            await self._lookup(batch)
+        finally:
+            # Cancelled before the lookup finished; fail the waiters instead of leaving them waiting forever
+            for future in batch.values():
+                if not future.done():
+                    future.cancel()
+
+    async def _lookup(self, batch: dict) -> None:
+        if self.storage is not None:
+            try:
+                saved = await self.storage.get_tracks(list(batch))
+            except Exception as e:
+                print(e)
+                saved = {}
+            self.storageHits += len(saved)
+            for video_id, (title, artist) in saved.items():
+                info = trackInfo(video_id, title, artist)
+                self._store(video_id, info)
+                future = batch.pop(video_id)
+                if not future.done():
+                    future.set_result(info)
+            if not batch:
+                return
+        self.batches += 1
+        try:
+            if self.scheduler is not None:
+                response = await self.scheduler.run(None, lambda: self.youtube.videos(list(batch)))
+            else:
+                response = await self.youtube.videos(list(batch))
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        found = {item['id']: snippetInfo(item['id'], item['snippet'])
+                 for item in response.get('items', [])}
+        for video_id, future in batch.items():
+            info = found.get(video_id)
+            self._store(video_id, info)
+            if not future.done():
+                future.set_result(info)
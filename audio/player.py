@@ -0,0 +1,395 @@
+import asyncio
+import time
+import discord
+from .tracks import TrackQueue
+
+# Seconds a disconnected player waits for commands before it is evicted, releasing its queue
+PLAYER_IDLE_TIMEOUT = 300
+# Seconds a connected player may sit stopped or with an empty queue before it leaves the voice channel
+VOICE_IDLE_TIMEOUT = 300
+# Seconds a paused player stays connected
+VOICE_PAUSED_TIMEOUT = 900
+# Number of upcoming tracks whose stream URLs are resolved while a track plays
+PREFETCH_TRACKS = 2
+# Minimum seconds between progress updates while a playlist is loading
+PLAYLIST_PROGRESS_INTERVAL = 2
+
+
+class GuildPlayer:
+    def __init__(self, music, guild_id: int, idleTimeout: float = PLAYER_IDLE_TIMEOUT,
+                 voiceTimeout: float = VOICE_IDLE_TIMEOUT, pausedTimeout: float = VOICE_PAUSED_TIMEOUT) -> None:
+        """
+        Voice connection, queue and playback state of one guild.
+
+        Every state change runs as a command on the player's own task, one at a time, so
+        slash commands, playlist loads and the voice thread's end-of-track callback never
+        interleave. After each command the player arms its idle timer on music.timers:
+        a connected player that is paused or not playing leaves the voice channel once
+        the timer fires, and a disconnected player releases its queue, exits its task and
+        removes itself from music.players. With music.snapshots the queue is kept in the
+        database instead of being dropped, and restored when the guild uses the cog again.
+
+        Args:
+            music (cogs.music.Music): The cog holding the shared extractor, caches and timer wheel.
+            guild_id (int): The guild this player belongs to.
+            idleTimeout (float, optional): Seconds a disconnected player waits before eviction.
+            voiceTimeout (float, optional): Seconds a connected player may be idle before it disconnects.
+            pausedTimeout (float, optional): Seconds a paused player stays connected.
+        """
+        self.music = music
+        self.guild_id = guild_id
+        self.idleTimeout = idleTimeout
+        self.voiceTimeout = voiceTimeout
+        self.pausedTimeout = pausedTimeout
+        self.queue = TrackQueue()
+        self.voice = None
+        self.playing = False
+        self.paused = False
+        # Bumped whenever playback is started or stopped, so end-of-track callbacks of
+        # tracks that were stopped on purpose are ignored
+        self.generation = 0
+        # Interaction that started the current track, used for announcements
+        self.interaction = None
+        # Playlists still being loaded into the queue
+        self.loads = set()
+        # Monotonic time of the last command, from which idle timeouts are measured
+        self.lastActive = time.monotonic()
+        # Set by _reap to end the player's task
+        self.evicted = False
+        self._commands = asyncio.Queue()
+        self._task = None
+        self._ensureRunning()
+        # Resolved once the guild's saved queue, if any, has been loaded
+        self.restored = None
+        snapshots = music.snapshots
+        if snapshots is not None and snapshots.claim(guild_id):
+            # Queued first, so every later command sees the restored queue
+            self.restored = asyncio.get_running_loop().create_future()
+            self._post(self._restore, future=self.restored)
+        self._armIdleTimer()
+
+    @property
+    def connected(self) -> bool:
+        return self.voice is not None and self.voice.is_connected()
+
+    async def submit(self, command, *args):
+        """
+        Runs command(*args) on the player's task after the commands queued before it.
+
+        Returns:
+            Whatever the command returned.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._post(command, *args, future=future)
+        return await future
+
+    def post(self, command, *args) -> None:
+        """
+        Queues command(*args) without waiting for it. Safe to call from other threads through call_soon_threadsafe.
+        """
+        self._post(command, *args, future=None)
+
+    def load(self, pages, queued: int, interaction: discord.Interaction) -> None:
+        """
+        Streams the remaining pages of a playlist into the queue in the background.
+        """
+        task = asyncio.create_task(self._loadPlaylist(pages, queued, interaction))
+        self.loads.add(task)
+        task.add_done_callback(self.loads.discard)
+
+    def cancelLoads(self) -> None:
+        for task in list(self.loads):
+            task.cancel()
+
+    def close(self) -> None:
+        self.cancelLoads()
+        self.music.timers.cancel(self.guild_id)
+        if self._task is not None:
+            self._task.cancel()
+
+    # Commands, run on the player's task
+
+    async def connect(self, channel) -> None:
+        if not self.connected:
+            self.voice = await channel.connect()
+        elif self.voice.channel != channel:
+            await self.voice.move_to(channel)
+
+    async def disconnect(self) -> bool:
+        """
+        Returns:
+            bool: False if the player was not connected.
+        """
+        if self.voice is None:
+            return False
+        self._stopPlayback()
+        await self.voice.disconnect()
+        self.voice = None
+        return True
+
+    async def enqueue(self, tracks) -> int:
+        return self.queue.extend(tracks)
+
+    async def start(self, interaction: discord.Interaction, trackEnded: float = None) -> None:
+        """
+        Plays the current track, or the next one if there is none, unless audio is already playing.
+        """
+        if self.playing or self.paused:
+            self._prefetch()
+            await interaction.followup.send("Added to queue.")
+            return
+        track = self.queue.current or self.queue.advance()
+        if track is None:
+            await interaction.followup.send("No more songs in queue.")
+            return
+        music = self.music
+        try:
+            path = music.audioCache.lookup(
+                track.video_id) if music.audioCache else None
+            if path is not None:
+                prefetched = True
+                source = music.sources.createLocal(path)
+            else:
+                prefetched = music.streams.peek(track.video_id) is not None
+                stream = await music.getStream(track.url, interaction)
+                if stream is None:
+                    return
+                source = await music.sources.create(stream)
+            self.generation += 1
+            generation = self.generation
+            loop = asyncio.get_running_loop()
+            try:
+                self.voice.play(source, after=lambda e: loop.call_soon_threadsafe(self.post, self._trackEnded, generation, time.perf_counter()))
+            except Exception:
+                # FFmpeg was already spawned, kill it rather than leaving it to the garbage collector
+                source.cleanup()
+                raise
+            self.playing = True
+            self.paused = False
+            self.interaction = interaction
+            if trackEnded is not None:
+                music.trackSwitches += 1
+                music.prefetchedSwitches += prefetched
+                music.switchTime += time.perf_counter() - trackEnded
+            self._prefetch()
+        except Exception as e:
+            print(e)
+            self.playing = self.paused = False
+            await interaction.followup.send("Could not play the song. Please try again.")
+            return
+        if music.audioCache:
+            try:
+                await music.audioCache.recordPlay(track.video_id, self.guild_id)
+            except Exception as e:
+                print(e)
+        await interaction.followup.send("Now playing!")
+
+    async def skip(self, interaction: discord.Interaction) -> None:
+        if not self.queue.upcoming:
+            await interaction.followup.send("No more songs in queue.")
+            return
+        self._stopPlayback()
+        self.queue.advance()
+        await self.start(interaction)
+
+    async def previous(self, interaction: discord.Interaction) -> None:
+        if not self.queue.history:
+            await interaction.followup.send("No previous songs in queue.")
+            return
+        self._stopPlayback()
+        self.queue.rewind()
+        await self.start(interaction)
+
+    async def pause(self) -> bool:
+        if not self.playing:
+            return False
+        self.voice.pause()
+        self.playing = False
+        self.paused = True
+        return True
+
+    async def resume(self) -> bool:
+        if not self.paused:
+            return False
+        self.voice.resume()
+        self.playing = True
+        self.paused = False
+        return True
+
+    async def stop(self) -> bool:
+        if not self.playing:
+            return False
+        self._stopPlayback()
+        return True
+
+    async def clear(self) -> None:
+        self.cancelLoads()
+        self._stopPlayback()
+        self.queue.clear()
+
+    async def shuffle(self) -> bool:
+        if not self.queue.upcoming:
+            return False
+        self.queue.shuffle()
+        return True
+
+    async def _trackEnded(self, generation: int, ended: float) -> None:
+        if generation != self.generation:
+            return
+        self.playing = False
+        if not self.connected:
+            return
+        if self.queue.advance() is None:
+            await self.interaction.followup.send("No more songs in queue.")
+            return
+        await self.start(self.interaction, ended)
+
+    async def _restore(self) -> None:
+        try:
+            await self.music.snapshots.restore(self.guild_id, self.queue)
+        except Exception as e:
+            print(f"Could not restore the queue of {self.guild_id}: {e}")
+
+    async def _reap(self) -> None:
+        """
+        Disconnects an idle player, or evicts a disconnected one, if it is still idle when its timer fires.
+        """
+        limit = self._idleLimit()
+        if limit is None or time.monotonic() - self.lastActive < limit:
+            return
+        if self.voice is not None:
+            await self.disconnect()
+            self.music.idleDisconnects += 1
+            # The queue survives for idleTimeout more seconds in case someone comes back
+            self.lastActive = time.monotonic()
+            return
+        if self.loads or not self._commands.empty():
+            return
+        if self.music.snapshots is not None:
+            # Hands the queue over; the snapshots only keep it until it is written
+            self.music.snapshots.park(self.guild_id, self.queue)
+            self.queue = TrackQueue()
+        else:
+            self.queue.clear()
+        if self.music.players.get(self.guild_id) is self:
+            del self.music.players[self.guild_id]
+        self.music.evictions += 1
+        self.evicted = True
+
+    # Helpers
+
+    def _idleLimit(self) -> float:
+        """
+        Returns the seconds of inactivity after which the player is reaped in its current state, or None while it is playing.
+        """
+        if self.voice is None:
+            return self.idleTimeout
+        if self.playing:
+            return None
+        return self.pausedTimeout if self.paused else self.voiceTimeout
+
+    def _armIdleTimer(self) -> None:
+        timers = self.music.timers
+        limit = self._idleLimit()
+        if limit is None:
+            timers.cancel(self.guild_id)
+        else:
+            timers.schedule(self.guild_id, self.lastActive + limit - time.monotonic(),
+                            lambda: self.post(self._reap))
+
+    def _stopPlayback(self) -> None:
+        # Invalidate the callback vc.stop() is about to trigger
+        self.generation += 1
+        if self.voice is not None and (self.playing or self.paused):
+            self.voice.stop()
+        self.playing = self.paused = False
+
+    def _prefetch(self) -> None:
+        """
+        Starts resolving the stream URLs of the next PREFETCH_TRACKS tracks in the background.
+        """
+        streams = self.music.streams
+        audioCache = self.music.audioCache
+        for track in self.queue.peek(PREFETCH_TRACKS):
+            if audioCache and track.video_id in audioCache.files:
+                continue
+            if streams.peek(track.video_id) is None:
+                streams.refresh(track.video_id, self.guild_id)
+
+    def _post(self, command, *args, future) -> None:
+        self._ensureRunning()
+        self._commands.put_nowait((command, args, future))
+
+    def _ensureRunning(self) -> None:
+        # Re-register a player that was evicted while a caller still held it
+        if self._task is None or self._task.done():
+            self.music.players[self.guild_id] = self
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            command, args, future = await self._commands.get()
+            # The caller gave up, e.g. a playlist load cancelled by /clear
+            if future is not None and future.done():
+                continue
+            if command != self._reap:
+                self.lastActive = time.monotonic()
+            try:
+                result = await command(*args)
+            except Exception as e:
+                if future is None:
+                    print(e)
+                else:
+                    future.set_exception(e)
+            else:
+                if future is not None and not future.done():
+                    future.set_result(result)
+            if self.music.snapshots is not None and not self.evicted:
+                self.music.snapshots.mark(self.guild_id, self.queue)
+            if self.evicted:
+                self.evicted = False
+                self.music.timers.cancel(self.guild_id)
+                return
+            self._armIdleTimer()
+
+    async def _loadPlaylist(self, pages, queued: int, interaction: discord.Interaction) -> None:
+        """
+        Appends the remaining pages of a playlist to the queue, editing a progress message as it goes.
+
+        Args:
+            pages (async generator): The playlist pages not consumed yet.
+            queued (int): Number of songs already queued from the playlist.
+            interaction (discord.Interaction): The interaction that started the load.
+        """
+        message = None
+        lastUpdate = 0
+        try:
+            async for songs in pages:
+                added = await self.submit(self.enqueue, songs)
+                queued += added
+                if added < len(songs):
+                    content = f"The queue is full: {queued} songs queued."
+                    break
+                if time.monotonic() - lastUpdate >= PLAYLIST_PROGRESS_INTERVAL:
+                    lastUpdate = time.monotonic()
+                    if message is None:
+                        message = await interaction.followup.send(f"Loading playlist... {queued} songs queued.", wait=True)
+                    else:
+                        await message.edit(content=f"Loading playlist... {queued} songs queued.")
+            else:
+                content = f"Finished loading playlist: {queued} songs queued."
+        except asyncio.CancelledError:
+            content = f"Stopped loading playlist after {queued} songs."
+            raise
+        except Exception as e:
+            print(e)
+            content = f"Could not load the rest of the playlist: {queued} songs queued."
+        finally:
+            await pages.aclose()
+            try:
+                if message is None:
+                    await interaction.followup.send(content)
+                else:
+                    await message.edit(content=content)
+            except Exception as e:
+                print(e)
@@ -0,0 +1,169 @@
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+# Maximum number of resolves (yt-dlp extractions and API requests) running at once
+RESOLVE_CONCURRENCY = 4
+# Number of guilds with the deepest resolve queues listed in stats()
+RESOLVE_STATS_GUILDS = 3
+
+
+class ResolveJob:
+    __slots__ = ("guild_id", "factory", "future", "key", "urgent", "queued")
+
+    def __init__(self, guild_id: int, factory, future: asyncio.Future, key, urgent: bool) -> None:
+        self.guild_id = guild_id
+        self.factory = factory
+        self.future = future
+        self.key = key
+        self.urgent = urgent
+        self.queued = time.perf_counter()
+
+
+class ResolveScheduler:
+    def __init__(self, concurrency: int = RESOLVE_CONCURRENCY) -> None:
+        """
+        Admission control for resolves shared by every guild.
+
+        At most concurrency resolves run at once. Waiting resolves are split into an
+        urgent class, for tracks about to play and interactive requests, and a background
+        class for prefetches and playlist pages. Urgent resolves always start first, and
+        within a class guilds take turns, so one guild's large playlist cannot starve
+        the others.
+
+        Args:
+            concurrency (int, optional): Maximum number of resolves running at once.
+        """
+        self.concurrency = concurrency
+        self.running = 0
+        # Urgent and background queues: Guild ID -> deque of jobs, rotated after every dispatch
+        self.queues = (OrderedDict(), OrderedDict())
+        # Key -> job that has not started yet
+        self.pending = {}
+        # Guild ID -> [queued, started, total wait, longest wait]
+        self.guilds = {}
+        # Running jobs; the event loop only keeps weak references to tasks
+        self.tasks = set()
+        self.started = 0
+        self.waitTime = 0.0
+        self.maxWait = 0.0
+
+    async def run(self, guild_id: int, factory, urgent: bool = False, key=None):
+        """
+        Runs await factory() once a slot is free and it is the guild's turn.
+
+        Args:
+            guild_id (int): The guild the resolve is for.
+            factory (callable): Function returning the awaitable to run.
+            urgent (bool, optional): Whether the result is needed for playback right now.
+            key (optional): Identifies the resolve; a resolve already waiting under the same key is shared.
+
+        Returns:
+            Whatever the awaitable returned.
+        """
+        job = self.pending.get(key) if key is not None else None
+        if job is None:
+            job = ResolveJob(guild_id, factory, asyncio.get_running_loop().create_future(), key, urgent)
+            if key is not None:
+                self.pending[key] = job
+            self.queues[0 if urgent else 1].setdefault(
+                guild_id, deque()).append(job)
+            self.guilds.setdefault(guild_id, [0, 0, 0.0, 0.0])[0] += 1
+            self._dispatch()
+        elif urgent:
+            self.promote(key)
+        if key is None:
+            return await job.future
+        # Shared jobs keep running for the other waiters when one caller gives up
+        return await asyncio.shield(job.future)
+
+    def promote(self, key) -> None:
+        """
+        Moves a waiting background resolve into the urgent class.
+        """
+        job = self.pending.get(key)
+        if job is None or job.urgent:
+            return
+        jobs = self.queues[1][job.guild_id]
+        jobs.remove(job)
+        if not jobs:
+            del self.queues[1][job.guild_id]
+        job.urgent = True
+        self.queues[0].setdefault(job.guild_id, deque()).append(job)
+        self._dispatch()
+
+    def stats(self) -> dict:
+        guilds = self.guildStats()
+        busiest = sorted(guilds.items(), key=lambda item: (
+            item[1]["queued"], item[1]["avg wait (ms)"]), reverse=True)[:RESOLVE_STATS_GUILDS]
+        return {
+            "resolves running": self.running,
+            "resolves queued": sum(guild["queued"] for guild in guilds.values()),
+            "avg resolve wait (ms)": round(self.waitTime / max(self.started, 1) * 1000, 1),
+            "max resolve wait (ms)": round(self.maxWait * 1000, 1),
+            **{f"resolve queue {guild_id}": f"{guild['queued']} queued, {guild['avg wait (ms)']} ms avg wait"
+               for guild_id, guild in busiest},
+        }
+
+    def guildStats(self) -> dict:
+        """
+        Returns the queue depth and wait times of every guild that has used the scheduler.
+        """
+        return {guild_id: {
+            "queued": queued,
+            "started": started,
+            "avg wait (ms)": round(waited / max(started, 1) * 1000, 1),
+            "max wait (ms)": round(longest * 1000, 1),
+        } for guild_id, (queued, started, waited, longest) in self.guilds.items()}
+
+    def _next(self) -> ResolveJob:
+        for queue in self.queues:
+            while queue:
+                guild_id, jobs = next(iter(queue.items()))
+                job = jobs.popleft()
+                if jobs:
+                    queue.move_to_end(guild_id)
+                else:
+                    del queue[guild_id]
+                if job.key is not None:
+                    self.pending.pop(job.key, None)
+                self.guilds[guild_id][0] -= 1
+                # Skip jobs whose caller was cancelled while waiting
+                if not job.future.done():
+                    return job
+        return None
+
+    def _dispatch(self) -> None:
+        while self.running < self.concurrency:
+            job = self._next()
+            if job is None:
+                return
+            waited = time.perf_counter() - job.queued
+            guild = self.guilds[job.guild_id]
+            guild[1] += 1
+            guild[2] += waited
+            guild[3] = max(guild[3], waited)
+            self.started += 1
+            self.waitTime += waited
+            self.maxWait = max(self.maxWait, waited)
+            self.running += 1
+            task = asyncio.create_task(self._execute(job))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def _execute(self, job: ResolveJob) -> None:
+        try:
+            result = await job.factory()
+        except Exception as e:
+            if not job.future.done():
+                job.future.set_exception(e)
+        else:
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            # The factory raised CancelledError or the task was cancelled; fail the
+            # waiters instead of leaving them waiting forever
+            if not job.future.done():
+                job.future.cancel()
+            self.running -= 1
+            self._dispatch()
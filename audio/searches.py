@@ -0,0 +1,86 @@
+import re
+import time
+from collections import OrderedDict
+
+# Seconds cached search results stay valid
+SEARCH_CACHE_TTL = 7 * 24 * 3600
+# Maximum number of queries kept in the database
+SEARCH_CACHE_SIZE = 20000
+# Number of hot queries kept in memory in front of the database
+SEARCH_MEMORY_SIZE = 512
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalizeQuery(query: str) -> str:
+    """
+    Folds case and whitespace so equivalent searches share one cache entry.
+    """
+    return WHITESPACE.sub(" ", query).strip().casefold()
+
+
+class SearchCache:
+    def __init__(self, storage=None, ttl: float = SEARCH_CACHE_TTL, maxEntries: int = SEARCH_CACHE_SIZE, memorySize: int = SEARCH_MEMORY_SIZE) -> None:
+        """
+        Two-level cache of YouTube search results keyed by normalized query.
+
+        Hot queries are answered from an in-memory LRU; the rest fall through to the
+        search_cache table, which survives restarts and is bounded to maxEntries queries.
+
+        Args:
+            storage (database.Storage, optional): Backing store. Without one only the memory layer is used.
+            ttl (float, optional): Seconds results stay valid.
+            maxEntries (int, optional): Maximum number of queries kept in the database.
+            memorySize (int, optional): Maximum number of queries kept in memory.
+        """
+        self.storage = storage
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        self.memorySize = memorySize
+        # Normalized query -> (expiry time, results)
+        self.entries = OrderedDict()
+        self.memoryHits = 0
+        self.storageHits = 0
+        self.misses = 0
+
+    async def get(self, query: str):
+        """
+        Returns the cached results of a query, or None.
+        """
+        query = normalizeQuery(query)
+        entry = self.entries.get(query)
+        if entry is not None and entry[0] > time.time():
+            self.memoryHits += 1
+            self.entries.move_to_end(query)
+            return entry[1]
+        row = None
+        if self.storage is not None:
+            row = await self.storage.get_search_results(query, self.ttl)
+        if row is None:
+            self.entries.pop(query, None)
+            self.misses += 1
+            return None
+        self.storageHits += 1
+        self._remember(query, row[1], row[0])
+        return row[1]
+
+    async def put(self, query: str, results: list) -> None:
+        query = normalizeQuery(query)
+        self._remember(query, results, time.time())
+        if self.storage is not None:
+            await self.storage.put_search_results(query, results, self.maxEntries)
+
+    def stats(self) -> dict:
+        lookups = self.memoryHits + self.storageHits + self.misses
+        return {
+            "search memory hits": self.memoryHits,
+            "search storage hits": self.storageHits,
+            "search misses": self.misses,
+            "search hit rate": f"{(self.memoryHits + self.storageHits) / lookups:.1%}" if lookups else "-",
+        }
+
+    def _remember(self, query: str, results: list, created: float) -> None:
+        self.entries[query] = (created + self.ttl, results)
+        self.entries.move_to_end(query)
+        while len(self.entries) > self.memorySize:
+            self.entries.popitem(last=False)
@@ -0,0 +1,158 @@
+from .tracks import Track, TrackQueue
+
+# Seconds between snapshot writes; queues changed in between are saved together
+SNAPSHOT_INTERVAL = 30
+# Maximum number of videos whose metadata is kept in the database
+SNAPSHOT_TRACKS = 100000
+
+
+class QueueSnapshots:
+    def __init__(self, storage, metadata=None, maxTracks: int = SNAPSHOT_TRACKS) -> None:
+        """
+        Saves music queues to the database so they survive restarts.
+
+        Players mark their queue after every command, and flush() writes only the queues
+        whose version changed since they were last saved, together with the metadata of
+        tracks not saved before, in one request. Saved queues are read back one guild at
+        a time, when the guild first uses the music cog after a restart, so startup only
+        loads the list of guild IDs.
+
+        Args:
+            storage (database.Storage): Storage holding the snapshots.
+            metadata (MetadataBatcher, optional): Looks up tracks whose metadata was evicted.
+            maxTracks (int, optional): Maximum number of videos whose metadata is kept.
+        """
+        self.storage = storage
+        self.metadata = metadata
+        self.maxTracks = maxTracks
+        # Guild IDs with a saved queue that was not restored yet
+        self.pending = set()
+        # Guild ID -> (id(queue), version) last saved or restored, for queues of live
+        # players only; the id tells a guild's new player apart from an evicted one at the
+        # same version without keeping the queue alive
+        self.saved = {}
+        # Guild ID -> queue changed since the last flush, including parked queues
+        self.dirty = {}
+        # Video IDs whose metadata is already in the database
+        self.known = set()
+        self.restored = 0
+        self.writes = 0
+
+    async def load(self) -> None:
+        """
+        Reads which guilds have a saved queue.
+        """
+        self.pending = set(await self.storage.get_queue_guilds())
+
+    def claim(self, guild_id: int) -> bool:
+        """
+        Returns True once for a guild with a saved queue that still has to be restored.
+        """
+        if guild_id not in self.pending:
+            return False
+        self.pending.discard(guild_id)
+        return True
+
+    async def restore(self, guild_id: int, queue: TrackQueue) -> bool:
+        """
+        Fills queue with a guild's saved queue.
+
+        Tracks without saved metadata are looked up through the metadata batcher, and
+        dropped if YouTube no longer has them.
+
+        Returns:
+            bool: False if the guild had no saved queue.
+        """
+        parked = self.dirty.pop(guild_id, None)
+        if parked is not None:
+            # Evicted before its last change was flushed
+            queue.restore(parked.history, parked.current, parked.upcoming)
+            self.dirty[guild_id] = queue
+            self.restored += 1
+            return True
+        snapshot = await self.storage.get_queue(guild_id)
+        if snapshot is None:
+            return False
+        video_ids, played, current = snapshot
+        found = await self.storage.get_tracks(video_ids)
+        self.known.update(found)
+        missing = [video_id for video_id in dict.fromkeys(video_ids)
+                   if video_id not in found]
+        if missing and self.metadata is not None:
+            for info in await self.metadata.getMany(missing):
+                if info is not None:
+                    found[info['video_id']] = (info['title'], info['artist'])
+        tracks = [Track(video_id, *found[video_id]) if video_id in found else None
+                  for video_id in video_ids]
+        end = played + current
+        queue.restore([track for track in tracks[:played] if track],
+                      tracks[played] if current else None,
+                      [track for track in tracks[end:] if track])
+        self.saved[guild_id] = (id(queue), queue.version)
+        self.restored += 1
+        return True
+
+    def mark(self, guild_id: int, queue: TrackQueue) -> None:
+        """
+        Schedules a guild's queue for the next flush if it changed since it was saved.
+        """
+        if self.saved.get(guild_id) != (id(queue), queue.version):
+            self.dirty[guild_id] = queue
+
+    def park(self, guild_id: int, queue: TrackQueue) -> None:
+        """
+        Keeps the queue of an evicted player in the database only, to be restored when the guild returns.
+
+        The player hands its queue over and must not change it afterwards. A queue with
+        unsaved changes is held until the next flush writes it; otherwise, and after that
+        flush, nothing here references it any more.
+        """
+        self.mark(guild_id, queue)
+        self.saved.pop(guild_id, None)
+        self.pending.add(guild_id)
+
+    async def flush(self) -> None:
+        """
+        Writes the queues marked since the last flush.
+        """
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, {}
+        queues = []
+        deleted = []
+        tracks = {}
+        for guild_id, queue in dirty.items():
+            entries = [*queue.history, *([queue.current] if queue.current else []), *queue.upcoming]
+            if entries:
+                queues.append((guild_id, " ".join(track.video_id for track in entries),
+                               len(queue.history), queue.current is not None))
+            else:
+                deleted.append(guild_id)
+            for track in entries:
+                if track.video_id not in self.known:
+                    tracks[track.video_id] = (track.video_id, track.title, track.artist)
+            # Parked queues are dropped once written; they are read back from the database
+            if guild_id not in self.pending:
+                self.saved[guild_id] = (id(queue), queue.version)
+        try:
+            await self.storage.save_queues(queues, deleted, list(tracks.values()), self.maxTracks)
+        except Exception as e:
+            print(f"Could not save music queues: {e}")
+            # Try again on the next flush
+            for guild_id, queue in dirty.items():
+                self.saved.pop(guild_id, None)
+                self.dirty.setdefault(guild_id, queue)
+            return
+        # Forget which videos are saved once the database may have evicted some of them
+        if len(self.known) + len(tracks) > self.maxTracks:
+            self.known.clear()
+        self.known.update(tracks)
+        self.writes += 1
+
+    def stats(self) -> dict:
+        return {
+            "saved queues pending restore": len(self.pending),
+            "queues restored": self.restored,
+            "dirty queues": len(self.dirty),
+            "snapshot writes": self.writes,
+        }
@@ -0,0 +1,135 @@
+import weakref
+import discord
+from .streams import Stream
+from .workers import AudioWorkerPool, WorkerAudio
+
+# Audio source modes: "opus" passes Opus streams through and transcodes the rest inside
+# FFmpeg, "pcm" decodes everything to PCM and lets discord.py encode it
+AUDIO_MODES = ("opus", "pcm")
+
+
+class SourceFactory:
+    def __init__(self, mode: str = "opus", before_options: str = None, options: str = None, workers: AudioWorkerPool = None) -> None:
+        """
+        Builds FFmpeg audio sources for resolved streams.
+
+        In "opus" mode, streams yt-dlp reports as Opus are copied without re-encoding,
+        streams in another codec are transcoded to Opus by FFmpeg, and streams of unknown
+        codec are probed first. "pcm" mode is the previous FFmpegPCMAudio behaviour,
+        where discord.py encodes every packet itself.
+
+        With workers, the same sources are produced in audio worker processes instead;
+        streams of unknown codec are transcoded there without probing.
+
+        Args:
+            mode (str, optional): One of AUDIO_MODES.
+            before_options (str, optional): FFmpeg options placed before the input.
+            options (str, optional): FFmpeg options placed after the input.
+            workers (AudioWorkerPool, optional): Worker processes producing the Opus frames.
+        """
+        if mode not in AUDIO_MODES:
+            raise ValueError(f"Unknown audio mode {mode!r}, expected one of {AUDIO_MODES}")
+        self.mode = mode
+        self.before_options = before_options
+        self.options = options
+        self.workers = workers
+        # Source kind -> number of sources created
+        self.created = {"local": 0, "passthrough": 0,
+                        "transcoded": 0, "probed": 0, "pcm": 0}
+        # Sources that may still own an FFmpeg process
+        self.live = weakref.WeakSet()
+        # Unplayed sources seen by the previous reap, killed if they are still unplayed
+        self.suspects = weakref.WeakSet()
+        self.killed = 0
+
+    async def create(self, stream: Stream) -> discord.AudioSource:
+        """
+        Returns an audio source playing stream.
+        """
+        if self.workers is not None:
+            kind, source = self._createInWorker(stream)
+        elif self.mode == "pcm":
+            kind = "pcm"
+            source = discord.FFmpegPCMAudio(
+                stream.url, before_options=self.before_options, options=self.options)
+        elif stream.codec is None:
+            kind = "probed"
+            source = await discord.FFmpegOpusAudio.from_probe(
+                stream.url, before_options=self.before_options, options=self.options)
+        elif stream.codec == "opus":
+            kind = "passthrough"
+            source = discord.FFmpegOpusAudio(
+                stream.url, codec="opus", before_options=self.before_options, options=self.options)
+        else:
+            kind = "transcoded"
+            source = discord.FFmpegOpusAudio(
+                stream.url, before_options=self.before_options, options=self.options)
+        self.created[kind] += 1
+        self.live.add(source)
+        return source
+
+    def createLocal(self, path: str) -> discord.AudioSource:
+        """
+        Returns an audio source copying a cached Opus file.
+        """
+        self.created["local"] += 1
+        if self.workers is not None:
+            source = self.workers.open("copy", path, options=self.options)
+        else:
+            source = discord.FFmpegOpusAudio(
+                path, codec="opus", options=self.options)
+        self.live.add(source)
+        return source
+
+    def processes(self) -> int:
+        """
+        Returns the number of FFmpeg processes still running in the bot process.
+        """
+        return sum(self._running(source) for source in self.live)
+
+    def reap(self, active) -> int:
+        """
+        Kills the FFmpeg processes of sources no voice client has played for two calls in a row.
+
+        The grace period leaves discord.py time to clean up after a track that was just
+        stopped, which it does on the audio thread.
+
+        Args:
+            active (set): The sources currently attached to voice clients.
+
+        Returns:
+            int: The number of processes killed.
+        """
+        unplayed = [source for source in self.live
+                    if source not in active and self._running(source)]
+        stray = [source for source in unplayed if source in self.suspects]
+        for source in stray:
+            source.cleanup()
+        self.suspects = weakref.WeakSet(
+            source for source in unplayed if source not in stray)
+        self.killed += len(stray)
+        return len(stray)
+
+    def stats(self) -> dict:
+        return {
+            **{f"{kind} sources": count for kind, count in self.created.items()},
+            "ffmpeg processes": self.processes(),
+            "stray ffmpeg killed": self.killed,
+        }
+
+    def _createInWorker(self, stream: Stream) -> tuple:
+        if self.mode == "pcm":
+            kind, session = "pcm", "pcm"
+        elif stream.codec == "opus":
+            kind, session = "passthrough", "copy"
+        else:
+            kind, session = "transcoded", "transcode"
+        return kind, self.workers.open(session, stream.url, self.before_options, self.options)
+
+    @staticmethod
+    def _running(source: discord.AudioSource) -> bool:
+        if isinstance(source, WorkerAudio):
+            return not source.closed
+        # discord.py exposes the FFmpeg child only as _process, which cleanup() resets
+        process = getattr(source, "_process", None)
+        return bool(process) and process.poll() is None
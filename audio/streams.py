@@ -0,0 +1,138 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+
+# Number of resolved stream URLs kept in memory
+STREAM_CACHE_SIZE = 2048
+# Seconds before expiry at which a cached stream URL is refreshed in the background
+STREAM_REFRESH_MARGIN = 600
+# Lifetime assumed for stream URLs that carry no expire timestamp
+STREAM_DEFAULT_TTL = 3600
+
+# YouTube stream URLs carry their expiry as a query parameter or a path segment
+EXPIRE_PATTERN = re.compile(r"[?&/]expire[=/](\d+)")
+
+
+def streamExpiry(url: str) -> float:
+    """
+    Returns the UNIX time at which a stream URL stops working.
+    """
+    match = EXPIRE_PATTERN.search(url)
+    return float(match.group(1)) if match else time.time() + STREAM_DEFAULT_TTL
+
+
+class Stream:
+    __slots__ = ("url", "codec", "bitrate", "expires")
+
+    def __init__(self, url: str, codec: str = None, bitrate: float = None) -> None:
+        """
+        A resolved audio stream.
+
+        Args:
+            url (str): The direct stream URL.
+            codec (str, optional): The audio codec reported by yt-dlp, e.g. "opus".
+            bitrate (float, optional): The average audio bitrate in kbit/s.
+        """
+        self.url = url
+        self.codec = codec
+        self.bitrate = bitrate
+        self.expires = streamExpiry(url)
+
+
+class StreamCache:
+    def __init__(self, resolver, maxSize: int = STREAM_CACHE_SIZE, margin: float = STREAM_REFRESH_MARGIN, prioritize=None) -> None:
+        """
+        Expiry-aware cache of resolved streams keyed by video id.
+
+        At most one resolve per video id is in flight; concurrent requests for the same
+        track wait on the same task. Entries close to their expire timestamp are still
+        served while a refresh runs in the background.
+
+        Args:
+            resolver (callable): Coroutine function resolving (video id, guild id, urgent) to a Stream.
+            maxSize (int, optional): Maximum number of cached streams.
+            margin (float, optional): Seconds before expiry at which entries are refreshed.
+            prioritize (callable, optional): Called with a video id when playback starts waiting on a background resolve.
+        """
+        self.resolver = resolver
+        self.maxSize = maxSize
+        self.margin = margin
+        self.prioritize = prioritize
+        # Video ID -> Stream
+        self.entries = OrderedDict()
+        # Video ID -> task resolving it
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def peek(self, video_id: str) -> Stream:
+        """
+        Returns a cached, unexpired stream without resolving, or None.
+        """
+        stream = self.entries.get(video_id)
+        if stream is None or stream.expires <= time.time():
+            return None
+        return stream
+
+    async def get(self, video_id: str, guild_id: int = None) -> Stream:
+        """
+        Returns the stream of a video, resolving it urgently only when no usable entry is cached.
+
+        Raises:
+            Exception: Whatever the resolver raised.
+        """
+        stream = self.entries.get(video_id)
+        now = time.time()
+        if stream is not None and stream.expires > now:
+            self.hits += 1
+            self.entries.move_to_end(video_id)
+            if stream.expires - now < self.margin:
+                self.refresh(video_id, guild_id)
+            return stream
+        self.misses += 1
+        # Shielded so one caller giving up does not cancel the resolve for the others
+        return await asyncio.shield(self.refresh(video_id, guild_id, urgent=True))
+
+    def refresh(self, video_id: str, guild_id: int = None, urgent: bool = False) -> asyncio.Task:
+        """
+        Starts resolving a video id unless a resolve for it is already running.
+
+        Args:
+            video_id (str): The video to resolve.
+            guild_id (int, optional): The guild the resolve is for.
+            urgent (bool, optional): Whether playback is waiting on the resolve.
+        """
+        task = self.inflight.get(video_id)
+        if task is None:
+            task = self.inflight[video_id] = asyncio.create_task(
+                self._resolve(video_id, guild_id, urgent))
+            task.add_done_callback(self._resolved)
+        elif urgent and self.prioritize is not None:
+            self.prioritize(video_id)
+        return task
+
+    def stats(self) -> dict:
+        return {
+            "cached streams": len(self.entries),
+            "stream hits": self.hits,
+            "stream misses": self.misses,
+            "stream resolves in flight": len(self.inflight),
+        }
+
+    async def _resolve(self, video_id: str, guild_id: int, urgent: bool) -> Stream:
+        try:
+            stream = await self.resolver(video_id, guild_id, urgent)
+        finally:
+            self.inflight.pop(video_id, None)
+        if stream is not None:
+            self.entries[video_id] = stream
+            self.entries.move_to_end(video_id)
+            while len(self.entries) > self.maxSize:
+                self.entries.popitem(last=False)
+        return stream
+
+    def _resolved(self, task: asyncio.Task) -> None:
+        # Retrieve the exception of background refreshes nobody awaited
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Stream resolve failed: {task.exception()}")
@@ -0,0 +1,73 @@
+import math
+
+# Seconds between timer wheel ticks, the resolution of every idle timeout
+TIMER_TICK = 5
+# Number of slots in the timer wheel; longer timeouts wrap around in rounds
+TIMER_SLOTS = 512
+
+
+class TimerWheel:
+    def __init__(self, tick: float = TIMER_TICK, slots: int = TIMER_SLOTS) -> None:
+        """
+        Hashed timer wheel shared by every guild.
+
+        Scheduling, rescheduling and cancelling a timer are dictionary operations, and
+        advance() only visits the slot whose time has come, so keeping a timer per guild
+        costs no task and no sleep per guild. The owner calls advance() every tick seconds.
+
+        Args:
+            tick (float, optional): Seconds between calls to advance().
+            slots (int, optional): Number of slots in the wheel.
+        """
+        self.tick = tick
+        # Slot -> {key: [remaining rounds, callback]}
+        self.slots = [{} for _ in range(slots)]
+        self.cursor = 0
+        # Key -> slot holding its timer
+        self.timers = {}
+        self.fired = 0
+
+    def __len__(self) -> int:
+        return len(self.timers)
+
+    def schedule(self, key, delay: float, callback) -> None:
+        """
+        Calls callback() once at least delay seconds have passed, replacing any timer already scheduled under key.
+        """
+        self.cancel(key)
+        ticks = max(math.ceil(delay / self.tick), 1)
+        slot = (self.cursor + ticks) % len(self.slots)
+        self.slots[slot][key] = [(ticks - 1) // len(self.slots), callback]
+        self.timers[key] = slot
+
+    def cancel(self, key) -> None:
+        slot = self.timers.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
+
+    def advance(self) -> None:
+        """
+        Moves the wheel one tick forward, running the callbacks that became due.
+        """
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        slot = self.slots[self.cursor]
+        due = []
+        for key, entry in list(slot.items()):
+            if entry[0]:
+                entry[0] -= 1
+                continue
+            del slot[key]
+            del self.timers[key]
+            due.append(entry[1])
+        for callback in due:
+            self.fired += 1
+            try:
+                callback()
+            except Exception as e:
+                print(e)
+
+    def stats(self) -> dict:
+        return {
+            "idle timers": len(self.timers),
+            "idle timers fired": self.fired,
+        }
@@ -0,0 +1,133 @@
+import sys
+from collections import deque
+from itertools import islice
+from random import shuffle
+
+# Maximum number of upcoming tracks per guild
+MAX_QUEUE_LENGTH = 10000
+# Number of played tracks kept for /prev
+HISTORY_SIZE = 50
+
+
+class Track:
+    __slots__ = ("video_id", "title", "artist")
+
+    def __init__(self, video_id: str, title: str, artist: str) -> None:
+        """
+        A queued YouTube video.
+
+        URLs are derived from the video ID instead of being stored, and artist names are
+        interned because long queues repeat the same few channels.
+        """
+        self.video_id = video_id
+        self.title = title
+        self.artist = sys.intern(artist)
+
+    @classmethod
+    def fromInfo(cls, info: dict) -> "Track":
+        """
+        Builds a track from a metadata dict as returned by snippetInfo.
+        """
+        return cls(info['video_id'], info['title'], info['artist'])
+
+    @property
+    def url(self) -> str:
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+    @property
+    def thumbnail(self) -> str:
+        return f"https://i.ytimg.com/vi/{self.video_id}/default.jpg"
+
+
+class TrackQueue:
+    def __init__(self, maxLength: int = MAX_QUEUE_LENGTH, historySize: int = HISTORY_SIZE) -> None:
+        """
+        A guild's current track, the tracks after it and a bounded history of played tracks.
+
+        Advancing and rewinding move single tracks between the ends of two deques, and
+        played tracks beyond historySize are dropped instead of accumulating.
+
+        Args:
+            maxLength (int, optional): Maximum number of upcoming tracks.
+            historySize (int, optional): Number of played tracks kept for rewinding.
+        """
+        self.maxLength = maxLength
+        self.current = None
+        self.upcoming = deque()
+        self.history = deque(maxlen=historySize)
+        # Bumped on every change, so snapshots can tell whether the queue needs saving
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self.upcoming) + (self.current is not None)
+
+    def extend(self, tracks) -> int:
+        """
+        Appends tracks until the queue is full.
+
+        Returns:
+            int: The number of tracks added.
+        """
+        room = self.maxLength - len(self.upcoming)
+        before = len(self.upcoming)
+        self.upcoming.extend(islice(tracks, max(room, 0)))
+        added = len(self.upcoming) - before
+        if added:
+            self.version += 1
+        return added
+
+    def advance(self) -> Track:
+        """
+        Moves the current track to the history and makes the next one current.
+
+        Returns:
+            Track: The new current track, or None if the queue has run out.
+        """
+        if self.current is not None:
+            self.history.append(self.current)
+        self.current = self.upcoming.popleft() if self.upcoming else None
+        self.version += 1
+        return self.current
+
+    def rewind(self) -> Track:
+        """
+        Puts the current track back in front of the queue and makes the last played one current.
+
+        Returns:
+            Track: The new current track, or None if there is no history.
+        """
+        if not self.history:
+            return None
+        if self.current is not None:
+            self.upcoming.appendleft(self.current)
+        self.current = self.history.pop()
+        self.version += 1
+        return self.current
+
+    def peek(self, count: int, start: int = 0):
+        """
+        Iterates over up to count upcoming tracks from position start, without copying the queue.
+        """
+        return islice(self.upcoming, start, start + count)
+
+    def shuffle(self) -> None:
+        tracks = list(self.upcoming)
+        shuffle(tracks)
+        self.upcoming = deque(tracks)
+        self.version += 1
+
+    def clear(self) -> None:
+        self.current = None
+        self.upcoming.clear()
+        self.history.clear()
+        self.version += 1
+
+    def restore(self, history, current: Track, upcoming) -> None:
+        """
+        Replaces the whole queue, e.g. with a saved snapshot.
+        """
+        self.history.clear()
+        self.history.extend(history)
+        self.current = current
+        self.upcoming = deque(islice(upcoming, self.maxLength))
+        self.version += 1
@@ -0,0 +1,208 @@
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from multiprocessing.connection import Connection
+import discord
+from . import encoder
+
+# Number of audio worker processes, 0 to run FFmpeg from the bot process
+AUDIO_WORKERS = 0
+# Batches of frames a session may buffer ahead of playback (FRAME_BATCH * 20 ms each)
+WORKER_CREDITS = 20
+# Seconds read() waits for the next frame before ending the track
+WORKER_READ_TIMEOUT = 10
+# Seconds workers get to end their sessions on shutdown before they are killed
+WORKER_STOP_TIMEOUT = 5
+# Workers exchange messages with the bot over pipes wrapped as multiprocessing
+# connections from raw file descriptors, which only works on POSIX systems
+WORKERS_SUPPORTED = os.name == "posix"
+
+
+class WorkerAudio(discord.AudioSource):
+    def __init__(self, worker: "AudioWorker", session_id: int) -> None:
+        """
+        Opus frames of one track, produced by an audio worker process.
+
+        The worker's reader thread appends frames as they arrive, and discord.py's player
+        thread pops one per read(), so sending a packet is all the bot process does.
+        """
+        self.worker = worker
+        self.session_id = session_id
+        self.frames = deque()
+        self.ready = threading.Condition()
+        self.done = False
+        self.error = None
+        self.closed = False
+        self.played = 0
+
+    def is_opus(self) -> bool:
+        return True
+
+    def read(self) -> bytes:
+        if not self.frames:
+            with self.ready:
+                self.ready.wait_for(lambda: self.frames or self.done, WORKER_READ_TIMEOUT)
+            if not self.frames:
+                if self.error:
+                    print(f"Audio worker session failed: {self.error}")
+                return b""
+        self.played += 1
+        if self.played % encoder.FRAME_BATCH == 0:
+            self.worker.send(("credit", self.session_id, 1))
+        return self.frames.popleft()
+
+    def cleanup(self) -> None:
+        if not self.closed:
+            self.closed = True
+            self.worker.close(self.session_id)
+
+    def _receive(self, frames: list, done: bool, error: str) -> None:
+        with self.ready:
+            self.frames.extend(frames)
+            if done:
+                self.done = True
+                self.error = error
+            self.ready.notify()
+
+
+class AudioWorker:
+    def __init__(self, index: int) -> None:
+        """
+        One audio worker process and the thread reading its frames.
+        """
+        self.process = subprocess.Popen(
+            [sys.executable, encoder.__file__], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.control = Connection(
+            os.dup(self.process.stdin.fileno()), readable=False)
+        self.output = Connection(
+            os.dup(self.process.stdout.fileno()), writable=False)
+        self.process.stdin.close()
+        self.process.stdout.close()
+        # Session ID -> WorkerAudio
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.frames = 0
+        self._reader = threading.Thread(
+            target=self._read, name=f"audio-worker-{index}", daemon=True)
+        self._reader.start()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def open(self, session_id: int, kind: str, source: str, before_options: str, options: str) -> WorkerAudio:
+        audio = self.sessions[session_id] = WorkerAudio(self, session_id)
+        self.send(("open", session_id, kind, source,
+                  before_options, options, WORKER_CREDITS))
+        return audio
+
+    def close(self, session_id: int) -> None:
+        if self.sessions.pop(session_id, None) is not None:
+            self.send(("close", session_id))
+
+    def send(self, message: tuple) -> None:
+        # Called from the event loop and from player threads
+        with self.lock:
+            if self.control.closed:
+                # Stopped; the worker ends every session on its own
+                return
+            try:
+                self.control.send(message)
+            except OSError as e:
+                print(f"Audio worker unreachable: {e}")
+
+    def stop(self) -> None:
+        # The worker ends its sessions and exits once its control pipe is closed
+        self.control.close()
+
+    def join(self, timeout: float) -> None:
+        try:
+            self.process.wait(max(timeout, 0))
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def _read(self) -> None:
+        while True:
+            try:
+                session_id, frames, done, error = self.output.recv()
+            except (EOFError, OSError):
+                break
+            self.frames += len(frames)
+            audio = self.sessions.get(session_id)
+            if audio is not None:
+                audio._receive(frames, done, error)
+        # End every track the worker was producing
+        for audio in list(self.sessions.values()):
+            audio._receive([], True, "audio worker exited")
+
+
+class AudioWorkerPool:
+    def __init__(self, workers: int) -> None:
+        """
+        Runs FFmpeg, Ogg demuxing and Opus encoding in separate processes.
+
+        Each track is a session on the worker with the fewest open sessions. Frames come
+        back in batches of FRAME_BATCH over the worker's stdout, so the bot process only
+        sends packets and the per-frame work of many guilds is no longer bound to the
+        one core holding its GIL. Workers that exit are replaced on the next open().
+        Only available where WORKERS_SUPPORTED is true.
+
+        Args:
+            workers (int): Number of worker processes.
+        """
+        if not WORKERS_SUPPORTED:
+            raise OSError("Audio workers need a POSIX system such as Linux or macOS")
+        self.workers = [AudioWorker(index) for index in range(workers)]
+        self._ids = itertools.count()
+        self.restarts = 0
+
+    def open(self, kind: str, source: str, before_options: str = None, options: str = None) -> WorkerAudio:
+        """
+        Starts producing a track on a worker.
+
+        Args:
+            kind (str): One of encoder.SESSION_KINDS.
+            source (str): Stream URL or file path passed to FFmpeg.
+            before_options (str, optional): FFmpeg options placed before the input.
+            options (str, optional): FFmpeg options placed after the input.
+
+        Returns:
+            WorkerAudio: An Opus audio source for VoiceClient.play().
+        """
+        for index, worker in enumerate(self.workers):
+            if not worker.alive:
+                self.workers[index] = AudioWorker(index)
+                self.restarts += 1
+        worker = min(self.workers, key=lambda worker: len(worker.sessions))
+        return worker.open(next(self._ids), kind, source, before_options, options)
+
+    async def close(self) -> None:
+        """
+        Stops every worker, killing those still running WORKER_STOP_TIMEOUT seconds later.
+
+        All workers are told to stop before any is waited for, and the waiting happens
+        on an executor thread, so shutdown blocks neither the event loop nor on each
+        worker in turn.
+        """
+        for worker in self.workers:
+            worker.stop()
+        await asyncio.get_running_loop().run_in_executor(None, self._join)
+
+    def _join(self) -> None:
+        deadline = time.monotonic() + WORKER_STOP_TIMEOUT
+        for worker in self.workers:
+            worker.join(deadline - time.monotonic())
+
+    def stats(self) -> dict:
+        return {
+            "audio workers": sum(worker.alive for worker in self.workers),
+            "audio worker sessions": sum(len(worker.sessions) for worker in self.workers),
+            "audio worker frames": sum(worker.frames for worker in self.workers),
+            "audio worker restarts": self.restarts,
+        }
@@ -0,0 +1,134 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import googleapiclient.discovery
+from googleapiclient.discovery_cache import get_static_doc
+
+# Number of threads issuing YouTube Data API requests
+YOUTUBE_API_WORKERS = 4
+# Number of results requested per search
+SEARCH_RESULTS = 10
+
+
+class YouTubeAPI:
+    _shared = None
+
+    def __init__(self, apiKey: str, workers: int = YOUTUBE_API_WORKERS) -> None:
+        """
+        Awaitable YouTube Data API client.
+
+        The discovery document bundled with google-api-python-client is read once, so no
+        request is spent fetching it. httplib2 connections are not thread safe, so each
+        worker thread builds its service from that document on first use and keeps it,
+        reusing its HTTP connections for every later request.
+
+        Args:
+            apiKey (str): The YouTube Data API key.
+            workers (int, optional): Number of threads issuing requests.
+        """
+        self.apiKey = apiKey
+        self.document = get_static_doc("youtube", "v3")
+        self._local = threading.local()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="youtube-api")
+        self.requests = 0
+        self.requestTime = 0.0
+
+    @classmethod
+    def shared(cls, apiKey: str) -> "YouTubeAPI":
+        """
+        Returns the process-wide client, creating it on first use.
+        """
+        if cls._shared is None:
+            cls._shared = cls(apiKey)
+        return cls._shared
+
+    async def search(self, query: str, maxResults: int = SEARCH_RESULTS) -> dict:
+        """
+        Returns the search.list response of videos matching a query.
+        """
+        return await self._call(lambda youtube: youtube.search().list(part="snippet", type="video", q=query, maxResults=maxResults))
+
+    async def videos(self, video_ids: list) -> dict:
+        """
+        Returns the videos.list response for up to 50 video IDs.
+        """
+        return await self._call(lambda youtube: youtube.videos().list(part="snippet", id=",".join(video_ids), maxResults=len(video_ids)))
+
+    async def playlistItems(self, playlist_id: str, pageToken: str = None) -> dict:
+        """
+        Returns one page (up to 50 items) of a playlist's playlistItems.list response.
+        """
+        return await self._call(lambda youtube: youtube.playlistItems().list(part="snippet", playlistId=playlist_id, maxResults=50, pageToken=pageToken))
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "api requests": self.requests,
+            "avg api request (ms)": round(self.requestTime / max(self.requests, 1) * 1000, 1),
+        }
+
+    async def _call(self, buildRequest) -> dict:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, self._execute, buildRequest)
+        finally:
+            self.requests += 1
+            self.requestTime += time.perf_counter() - started
+
+    def _execute(self, buildRequest) -> dict:
+        youtube = getattr(self._local, "youtube", None)
+        if youtube is None:
+            youtube = self._local.youtube = googleapiclient.discovery.build_from_document(
+                self.document, developerKey=self.apiKey)
+        return buildRequest(youtube).execute()
+
+
+class LocalYouTube:
+    def __init__(self, videos: dict = None, playlists: dict = None, searches: dict = None) -> None:
+        """
+        In-memory stand-in for YouTubeAPI, returning responses shaped like the real API.
+
+        Args:
+            videos (dict, optional): Video ID -> (title, channel title).
+            playlists (dict, optional): Playlist ID -> list of video IDs.
+            searches (dict, optional): Query -> list of video IDs.
+        """
+        self.videosByID = videos or {}
+        self.playlists = playlists or {}
+        self.searches = searches or {}
+        self.requests = 0
+
+    async def search(self, query: str, maxResults: int = SEARCH_RESULTS) -> dict:
+        self.requests += 1
+        return {"items": [{"id": {"kind": "youtube#video", "videoId": video_id}, "snippet": self._snippet(video_id)}
+                          for video_id in self.searches.get(query, [])[:maxResults]]}
+
+    async def videos(self, video_ids: list) -> dict:
+        self.requests += 1
+        return {"items": [{"id": video_id, "snippet": self._snippet(video_id)}
+                          for video_id in video_ids if video_id in self.videosByID]}
+
+    async def playlistItems(self, playlist_id: str, pageToken: str = None) -> dict:
+        self.requests += 1
+        video_ids = self.playlists.get(playlist_id, [])
+        start = int(pageToken or 0)
+        response = {"items": [{"snippet": {**self._snippet(video_id), "videoOwnerChannelTitle": self._snippet(video_id)["channelTitle"], "resourceId": {"videoId": video_id}}}
+                              for video_id in video_ids[start:start + 50]]}
+        if start + 50 < len(video_ids):
+            response["nextPageToken"] = str(start + 50)
+        return response
+
+    def close(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"api requests": self.requests}
+
+    def _snippet(self, video_id: str) -> dict:
+        title, channel = self.videosByID.get(video_id, (video_id, ""))
+        return {"title": title, "channelTitle": channel, "thumbnails": {"default": {"url": f"https://i.ytimg.com/vi/{video_id}/default.jpg"}}}
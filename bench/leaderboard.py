@@ -0,0 +1,82 @@
+"""
+Leaderboard and experience write throughput before and after the schema migrations.
+
+Builds a database the way the cogs used to create it (migration 1 only, rollback
+journal, synchronous=FULL), measures the /leaderboard and /lvlboard queries and
+committed single experience updates, then migrates the same file in place and measures
+again.
+
+    python bench/leaderboard.py [path]
+"""
+import os
+import random
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import migrations  # noqa: E402
+
+# Guilds and members per guild in the generated database
+GUILDS = 5
+MEMBERS = 20000
+# Queries and writes per measurement
+ROUNDS = 200
+
+
+def populate(connection: sqlite3.Connection) -> None:
+    for statement in migrations.MIGRATIONS[0]:
+        connection.execute(statement)
+    connection.executemany("INSERT INTO levels VALUES (?, ?, ?, ?, ?)", [
+        (guild_id, user_id, f"user{user_id}", random.randint(0, 100), random.randint(0, 50))
+        for guild_id in range(GUILDS) for user_id in range(MEMBERS)])
+    connection.executemany("INSERT INTO economy VALUES (?, ?, ?, ?, NULL)", [
+        (guild_id, user_id, f"user{user_id}", random.randint(0, 10**6))
+        for guild_id in range(GUILDS) for user_id in range(MEMBERS)])
+
+
+def measure(connection: sqlite3.Connection, label: str) -> None:
+    started = time.perf_counter()
+    for i in range(ROUNDS):
+        connection.execute("SELECT user_name, balance FROM economy WHERE guild_id = ? ORDER BY balance DESC LIMIT 10",
+                           (i % GUILDS,)).fetchall()
+    leaderboard = ROUNDS / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for i in range(ROUNDS):
+        connection.execute("SELECT user_name, experience, current_lvl FROM levels WHERE guild_id = ? ORDER BY current_lvl DESC, experience DESC LIMIT 10",
+                           (i % GUILDS,)).fetchall()
+    lvlboard = ROUNDS / (time.perf_counter() - started)
+    started = time.perf_counter()
+    for i in range(ROUNDS):
+        connection.execute("BEGIN")
+        connection.execute("UPDATE levels SET experience = experience + 5 WHERE guild_id = ? AND user_id = ?",
+                           (i % GUILDS, i))
+        connection.execute("COMMIT")
+    writes = ROUNDS / (time.perf_counter() - started)
+    print(f"{label:7s} /leaderboard {leaderboard:9.0f}/s  /lvlboard {lvlboard:9.0f}/s  xp commits {writes:9.0f}/s")
+
+
+def main() -> None:
+    path = sys.argv[1] if len(sys.argv) > 1 else "bench_leaderboard.db"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    connection = sqlite3.connect(path, isolation_level=None)
+    connection.execute("BEGIN")
+    populate(connection)
+    connection.execute("COMMIT")
+    measure(connection, "before")
+    connection.close()
+
+    connection = sqlite3.connect(path, isolation_level=None)
+    migrations.configure(connection)
+    migrations.migrate(connection)
+    measure(connection, "after")
+    connection.close()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Concurrency stress test for Storage.transfer and Storage.adjust_balance.
+
+Opens ACCOUNTS accounts, fires TRANSFERS random payments and ADJUSTMENTS random
+gambles at the storage thread all at once, and checks that no coins were lost or
+created: the total equals the starting total plus the applied gamble deltas, no balance
+is negative, and the cached balances agree with the database before and after the
+ledger is compacted. A member who is paid and then leaves must keep both sides of the
+payment in the ledger and start over with the starting balance on rejoining. Prints the
+throughput and exits with status 1 on a mismatch.
+
+    python bench/ledger_stress.py [path]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from database import Storage, ledger  # noqa: E402
+
+GUILD_ID = 1
+ACCOUNTS = 200
+STARTING_BALANCE = 1000
+TRANSFERS = 20000
+ADJUSTMENTS = 5000
+
+
+async def totals(storage: Storage) -> tuple:
+    """
+    Returns the (total, lowest) balance read from the database and the total of the cached balances.
+    """
+    balances = [await storage.run(ledger.balance, GUILD_ID, user_id, write=False) for user_id in range(ACCOUNTS)]
+    cached = [await storage.get_balance(GUILD_ID, user_id) for user_id in range(ACCOUNTS)]
+    return sum(balances), min(balances), sum(cached)
+
+
+async def stress(path: str) -> bool:
+    storage = Storage(path)
+    await storage.start()
+    for user_id in range(ACCOUNTS):
+        await storage.open_account(GUILD_ID, user_id, f"user{user_id}", STARTING_BALANCE)
+
+    # Random pairs include members paying themselves, which must not change any balance
+    transfers = [(random.randrange(ACCOUNTS), random.randrange(ACCOUNTS), random.randint(1, 60))
+                 for _ in range(TRANSFERS)]
+    adjustments = [(random.randrange(ACCOUNTS), random.choice((-1, 1)) * random.randint(1, 60))
+                   for _ in range(ADJUSTMENTS)]
+    # (gamble delta or 0 for a transfer, request), submitted in random order
+    requests = [(0, storage.transfer(GUILD_ID, sender_id, receiver_id, amount))
+                for sender_id, receiver_id, amount in transfers]
+    requests += [(delta, storage.adjust_balance(GUILD_ID, user_id, delta, abs(delta), "gamble"))
+                 for user_id, delta in adjustments]
+    random.shuffle(requests)
+    started = time.perf_counter()
+    results = await asyncio.gather(*(request for _, request in requests))
+    elapsed = time.perf_counter() - started
+
+    expected = ACCOUNTS * STARTING_BALANCE
+    expected += sum(delta for (delta, _), result in zip(requests, results) if result is not None)
+    print(f"{len(requests)} requests in {elapsed:.2f}s ({len(requests) / elapsed:.0f}/s), "
+          f"{sum(result is None for result in results)} refused for insufficient funds")
+
+    ok = True
+    for label in ("before compaction", "after compaction"):
+        total, lowest, cached = await totals(storage)
+        print(f"{label}: total {total} (expected {expected}), cached total {cached}, lowest balance {lowest}")
+        ok = ok and total == expected and cached == expected and lowest >= 0
+        await storage.compact_ledger(0)
+    ok = await rejoin(storage) and ok
+    print(storage.stats())
+    storage.close()
+    return ok
+
+
+async def rejoin(storage: Storage) -> bool:
+    """
+    Pays a member who then leaves and rejoins, checking that the ledger keeps both sides of the payment.
+    """
+    payer, member = ACCOUNTS, ACCOUNTS + 1
+    await storage.open_account(GUILD_ID, payer, "payer", STARTING_BALANCE)
+    await storage.open_account(GUILD_ID, member, "member", STARTING_BALANCE)
+    await storage.transfer(GUILD_ID, payer, member, 100)
+    await storage.close_account(GUILD_ID, member)
+    rows = await storage.fetchall("SELECT delta, reason FROM economy_ledger WHERE guild_id = ? AND user_id = ? ORDER BY id",
+                                  (GUILD_ID, member))
+    await storage.open_account(GUILD_ID, member, "member", STARTING_BALANCE)
+    rejoined = await storage.get_balance(GUILD_ID, member)
+    await storage.compact_ledger(0)
+    compacted = await storage.run(ledger.balance, GUILD_ID, member, write=False)
+    print(f"rejoin: ledger rows of the member who left {rows}, balance after rejoining {rejoined}, after compaction {compacted}")
+    return [tuple(row) for row in rows] == [(STARTING_BALANCE, "join"), (100, "pay"), (-STARTING_BALANCE - 100, "leave")] \
+        and rejoined == compacted == STARTING_BALANCE
+
+
+def main() -> None:
+    path = sys.argv[1] if len(sys.argv) > 1 else "bench_ledger.db"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    ok = asyncio.run(stress(path))
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    print("OK" if ok else "FAILED: coins were lost or created")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+"""
+Concurrent voice sessions per host for each audio source mode.
+
+Every session is a discord.py AudioPlayer thread playing a SourceFactory source into a
+fake voice client. The client encodes PCM the way VoiceClient does and sends RTP
+packets to a local UDP endpoint running in a separate process, which counts the packets
+of each session and the gaps between them. Packets are not encrypted.
+
+For each mode and session count it prints the packet delivery, the share of gaps longer
+than two frames and the CPU used by the bot process and by its child processes (FFmpeg
+and audio workers), then the largest session count each mode sustained.
+
+Modes:
+    pcm          FFmpeg decodes to PCM, discord.py encodes Opus in the bot process
+    transcode    FFmpeg transcodes to Opus
+    passthrough  FFmpeg copies the Opus stream
+    workers      FFmpeg copies the Opus stream inside --workers audio worker processes
+
+Runs on Linux only: CPU times are read from /proc, and audio workers need POSIX pipes.
+Requires discord.py[voice] with libopus and FFmpeg on PATH. Without --sample, a 30
+second Opus file of pink noise is generated with FFmpeg; every source loops its file.
+Workers mode starts one worker per core unless --workers is given.
+
+    python bench/voice_sessions.py --sessions 10 50 100 --modes pcm passthrough workers
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import discord  # noqa: E402
+from audio.sources import SourceFactory  # noqa: E402
+from audio.streams import Stream  # noqa: E402
+from audio.workers import AudioWorkerPool  # noqa: E402
+
+MODES = ("pcm", "transcode", "passthrough", "workers")
+# Seconds every session plays before and while it is measured
+WARMUP = 3
+WINDOW = 10
+# A session is sustained when every session gets this share of its packets...
+MIN_DELIVERY = 0.98
+# ...and at most this share of packets arrives more than LATE_GAP seconds after the previous one
+MAX_LATE = 0.01
+LATE_GAP = 0.040
+FRAME_LENGTH = 0.020
+
+
+def endpoint(address: tuple, control) -> None:
+    """
+    Fake voice server counting the packets of every SSRC and the gaps between them.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    sock.bind(address)
+    sock.settimeout(0.05)
+    counts, late, last = {}, {}, {}
+    while True:
+        if control.poll():
+            command = control.recv()
+            if command == "reset":
+                counts, late = {}, {}
+            elif command == "report":
+                control.send((counts, late))
+            else:
+                return
+        try:
+            packet = sock.recv(2048)
+        except socket.timeout:
+            continue
+        now = time.perf_counter()
+        ssrc = struct.unpack_from(">I", packet, 8)[0]
+        counts[ssrc] = counts.get(ssrc, 0) + 1
+        if now - last.get(ssrc, now) > LATE_GAP:
+            late[ssrc] = late.get(ssrc, 0) + 1
+        last[ssrc] = now
+
+
+class FakeVoiceClient:
+    def __init__(self, ssrc: int, sock: socket.socket, address: tuple, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        The parts of discord.VoiceClient that AudioPlayer uses, sending plain RTP packets.
+        """
+        self.ssrc = ssrc
+        self.sock = sock
+        self.address = address
+        self.sequence = 0
+        self.timestamp = 0
+        self.timeout = 5
+        self.encoder = discord.opus.Encoder()
+        self._connected = threading.Event()
+        self._connected.set()
+        self.client = types.SimpleNamespace(loop=loop)
+        self.ws = types.SimpleNamespace(speak=self._speak)
+
+    def is_connected(self) -> bool:
+        return True
+
+    def wait_until_connected(self, timeout: float = None) -> bool:
+        return True
+
+    def send_audio_packet(self, data: bytes, *, encode: bool = True) -> None:
+        if encode:
+            data = self.encoder.encode(data, self.encoder.SAMPLES_PER_FRAME)
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        header = struct.pack(">BBHII", 0x80, 0x78, self.sequence, self.timestamp, self.ssrc)
+        self.sock.sendto(header + data, self.address)
+        self.timestamp = (self.timestamp + self.encoder.SAMPLES_PER_FRAME) & 0xFFFFFFFF
+
+    async def _speak(self, state) -> None:
+        pass
+
+
+def processCpu(pid) -> float:
+    """
+    Returns the CPU seconds used by a process, or 0 if it is gone.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def descendantsCpu(exclude: set) -> float:
+    """
+    Returns the CPU seconds used by the running descendants of this process, except exclude and theirs.
+    """
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+            except OSError:
+                pass
+    children = {}
+    for pid, parent in parents.items():
+        children.setdefault(parent, []).append(pid)
+    total = 0.0
+    pending = [pid for pid in children.get(os.getpid(), []) if pid not in exclude]
+    while pending:
+        pid = pending.pop()
+        total += processCpu(pid)
+        pending.extend(children.get(pid, []))
+    return total
+
+
+def sample(directory: str) -> str:
+    path = os.path.join(directory, "sample.webm")
+    subprocess.run(["ffmpeg", "-loglevel", "error", "-y", "-f", "lavfi", "-i", "anoisesrc=color=pink:duration=30",
+                    "-ac", "2", "-ar", "48000", "-c:a", "libopus", "-b:a", "128k", path], check=True)
+    return path
+
+
+def factory(mode: str, pool: AudioWorkerPool) -> tuple:
+    """
+    Returns the (SourceFactory, codec reported for the sample) of a mode.
+    """
+    options = {"before_options": "-stream_loop -1", "options": "-vn -loglevel error"}
+    if mode == "pcm":
+        return SourceFactory("pcm", **options), "opus"
+    if mode == "transcode":
+        return SourceFactory("opus", **options), "vorbis"
+    return SourceFactory("opus", **options, workers=pool), "opus"
+
+
+async def measure(mode: str, sessions: int, workers: int, path: str, address: tuple, control, exclude: set) -> dict:
+    pool = AudioWorkerPool(workers) if mode == "workers" else None
+    sources, codec = factory(mode, pool)
+    loop = asyncio.get_running_loop()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    players = []
+    try:
+        for ssrc in range(1, sessions + 1):
+            source = await sources.create(Stream(path, codec))
+            player = discord.player.AudioPlayer(source, FakeVoiceClient(ssrc, sock, address, loop))
+            player.start()
+            players.append(player)
+        await asyncio.sleep(WARMUP)
+        control.send("reset")
+        started = time.perf_counter()
+        botCpu = processCpu(os.getpid())
+        childCpu = descendantsCpu(exclude)
+        await asyncio.sleep(WINDOW)
+        control.send("report")
+        counts, late = control.recv()
+        elapsed = time.perf_counter() - started
+        botCpu = processCpu(os.getpid()) - botCpu
+        childCpu = descendantsCpu(exclude) - childCpu
+    finally:
+        for player in players:
+            player.stop()
+        for player in players:
+            player.join(5)
+        if pool is not None:
+            await pool.close()
+        sock.close()
+    expected = elapsed / FRAME_LENGTH
+    delivery = min(counts.get(ssrc, 0) for ssrc in range(1, sessions + 1)) / expected
+    lateShare = sum(late.values()) / max(sum(counts.values()), 1)
+    return {
+        "mode": mode,
+        "sessions": sessions,
+        "min delivery": delivery,
+        "late gaps": lateShare,
+        "bot cpu": botCpu / elapsed,
+        "child cpu": childCpu / elapsed,
+        "sustained": delivery >= MIN_DELIVERY and lateShare <= MAX_LATE,
+    }
+
+
+async def run(arguments, path: str) -> None:
+    address = ("127.0.0.1", arguments.port)
+    control, remote = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=endpoint, args=(address, remote), daemon=True)
+    server.start()
+    sustained = {}
+    try:
+        for mode in arguments.modes:
+            for sessions in arguments.sessions:
+                result = await measure(mode, sessions, arguments.workers, path, address, control, {server.pid})
+                cpu = (result["bot cpu"] + result["child cpu"]) / sessions
+                print(f"{mode:11s} {sessions:4d} sessions  delivery {result['min delivery']:6.1%}  late gaps {result['late gaps']:6.2%}  "
+                      f"bot cpu {result['bot cpu']:6.1%}  child cpu {result['child cpu']:6.1%}  per session {cpu:6.2%}"
+                      f"{'' if result['sustained'] else '  NOT SUSTAINED'}", flush=True)
+                if result["sustained"]:
+                    sustained[mode] = max(sustained.get(mode, 0), sessions)
+                await asyncio.sleep(1)
+    finally:
+        control.send("stop")
+        server.join(5)
+    for mode in arguments.modes:
+        print(f"{mode}: sustained up to {sustained.get(mode, 0)} of the measured session counts on {os.cpu_count()} cores")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Concurrent voice sessions per audio source mode.")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[10, 50, 100])
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Audio worker processes in workers mode")
+    parser.add_argument("--sample", help="Opus file played by every session")
+    parser.add_argument("--port", type=int, default=50111)
+    arguments = parser.parse_args()
+    if not os.path.isdir("/proc"):
+        parser.error("CPU times are read from /proc, which only exists on Linux")
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(run(arguments, arguments.sample or sample(directory)))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,37 @@
-from discord.ext import commands
+from discord.ext import commands, tasks
 import discord
 import datetime
+import asyncio
+import io
+import time
+from collections import deque
+from database import Storage
+
+# Seconds between event loop latency samples
+LAG_SAMPLE_INTERVAL = 1
+# Number of latency samples kept for /stats
+LAG_SAMPLES = 60
+# Discord limits: characters per embed field value, fields per embed and characters
+# across all embeds of a message
+FIELD_LIMIT = 1024
+EMBED_FIELDS = 25
+MESSAGE_LIMIT = 6000
 
 
 class Admin(commands.Cog):
-    def __init__(self, bot: discord.Interaction) -> None:
+    def __init__(self, bot: discord.Interaction, storage: Storage = None) -> None:
         """
         Initializes the Admin cog.
 
         Args:
             bot (discord.ext.commands.Bot): The bot instance.
+            storage (database.Storage, optional): The storage layer reported by /stats.
         """
         self.bot = bot
+        self.storage = storage
+
+        # Recent event loop latency samples in seconds
+        self.loopLag = deque(maxlen=LAG_SAMPLES)
 
     async def is_admin(interaction: discord.Interaction) -> bool:
         """
@@ -37,6 +57,85 @@ class Admin(commands.Cog):
         """
         print("Admin cog is ready.")
 
+    async def cog_load(self) -> None:
+        self.sampleLoopLag.start()
+
+    async def cog_unload(self) -> None:
+        self.sampleLoopLag.cancel()
+
+    @tasks.loop(seconds=LAG_SAMPLE_INTERVAL)
+    async def sampleLoopLag(self) -> None:
+        """
+        Measures how long a ready callback waits before the event loop runs it.
+        """
+        started = time.perf_counter()
+        await asyncio.sleep(0)
+        self.loopLag.append(time.perf_counter() - started)
+
+    @discord.app_commands.command(name="stats", description="Shows internal bot statistics.")
+    @discord.app_commands.check(is_admin)
+    async def stats(self, interaction: discord.Interaction) -> None:
+        """
+        Shows event loop latency, storage load and the statistics reported by each cog.
+
+        Sections longer than an embed field are split across several fields, and those
+        across several embeds. If the message would exceed Discord's size limit, the
+        fields that fit are shown and the full statistics are attached as stats.txt.
+
+        Args:
+            interaction (discord.Interaction): The interaction object.
+        """
+        fields = []
+        if self.loopLag:
+            fields.append(("Event Loop Lag",
+                           f"avg: {sum(self.loopLag) / len(self.loopLag) * 1000:.3f} ms\nmax: {max(self.loopLag) * 1000:.3f} ms"))
+        sections = {}
+        if self.storage is not None:
+            sections["Storage"] = self.storage.stats()
+        for name, cog in self.bot.cogs.items():
+            if hasattr(cog, "stats") and callable(cog.stats) and cog is not self:
+                sections[name] = cog.stats()
+        for name, values in sections.items():
+            fields.extend(self._statsFields(name, values))
+
+        embeds = [discord.Embed(title="Bot Statistics", color=discord.Colour.blue(
+        ), timestamp=datetime.datetime.utcnow())]
+        length = len(embeds[0])
+        shown = 0
+        for name, value in fields:
+            if length + len(name) + len(value) > MESSAGE_LIMIT:
+                break
+            if len(embeds[-1].fields) == EMBED_FIELDS:
+                embeds.append(discord.Embed(color=discord.Colour.blue()))
+            embeds[-1].add_field(name=name, value=value, inline=False)
+            length += len(name) + len(value)
+            shown += 1
+        if shown == len(fields):
+            await interaction.response.send_message(embeds=embeds)
+            return
+        dump = "\n\n".join(f"{name}\n" + "\n".join(f"{key}: {value}" for key, value in values.items())
+                            for name, values in sections.items())
+        await interaction.response.send_message(embeds=embeds, file=discord.File(
+            io.BytesIO(dump.encode()), filename="stats.txt"))
+
+    def _statsFields(self, name: str, values: dict):
+        """
+        Splits a section of /stats into (name, value) embed fields of at most FIELD_LIMIT characters.
+        """
+        lines = [f"{key}: {value}"[:FIELD_LIMIT] for key, value in values.items()] or ["-"]
+        chunks = []
+        chunk, size = [], 0
+        for line in lines:
+            if chunk and size + len(line) > FIELD_LIMIT:
+                chunks.append(chunk)
+                chunk, size = [], 0
+            chunk.append(line)
+            # Counts the newline joining it to the next line
+            size += len(line) + 1
+        chunks.append(chunk)
+        return [(name if i == 0 else f"{name} ({i + 1})", "\n".join(chunk))
+                for i, chunk in enumerate(chunks)]
+
     @discord.app_commands.command(name="shutdown", description="Shuts down the bot.")
     @discord.app_commands.check(is_admin)
     async def shutdown(self, interaction: discord.Interaction) -> None:
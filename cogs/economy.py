@@ -1,75 +1,88 @@
-from discord.ext import commands
+from discord.ext import commands, tasks
 import discord
-import sqlite3
 import datetime
+import time
+from database import Storage, Leaderboard
 from random import randint
 
 STARTING_BALANCE = 1000
 DAILY_REWARD = 200
+# Seconds between ledger compactions
+LEDGER_COMPACT_INTERVAL = 300
+# Days of compacted ledger history kept for auditing
+LEDGER_RETENTION_DAYS = 30
 
 
 class Economy(commands.Cog):
-    def __init__(self, bot: commands.Bot, dbConnection: sqlite3.Connection):
+    def __init__(self, bot: commands.Bot, storage: Storage):
         self.bot = bot
-        self.connection = dbConnection
+        self.storage = storage
+        # on_ready fires on every reconnect, the member backfill only needs to run once
+        self.membersSynced = False
+        # Guild ID -> top balances, kept current by every balance write
+        self.leaderboardCache = Leaderboard()
         print("Econ DB Connection Established")
 
-    def __del__(self):
-        print("Econ DB Connection Closed.")
-        self.connection.close()
+    def stats(self) -> dict:
+        return {f"leaderboard {key}": value for key, value in self.leaderboardCache.stats().items()}
+
+    async def cog_load(self):
+        self.compactLedger.start()
+
+    async def cog_unload(self):
+        self.compactLedger.cancel()
+
+    @tasks.loop(seconds=LEDGER_COMPACT_INTERVAL)
+    async def compactLedger(self):
+        try:
+            folded, pruned = await self.storage.compact_ledger(LEDGER_RETENTION_DAYS * 86400)
+        except Exception as e:
+            # An exception would stop the loop for good; the next run folds the same rows
+            print(f"Could not compact the ledger: {e}")
+            return
+        if folded or pruned:
+            print(f"Ledger compacted: {folded} rows folded, {pruned} rows pruned")
 
     @commands.Cog.listener()
     async def on_ready(self):
         print("Economy cog is ready.")
-        self._initDatabase()
+        await self._initDatabase()
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
         id = int(member.guild.id)
-        self.connection.execute("INSERT OR IGNORE INTO economy (guild_id, user_id, user_name, balance) VALUES (?, ?, ?, ?)",
-                                (id, member.id, member.name, STARTING_BALANCE))
-        self.connection.commit()
+        inserted = await self.storage.open_account(id, member.id, member.name, STARTING_BALANCE)
+        if inserted:
+            self.leaderboardCache.update(
+                id, member.id, member.name, STARTING_BALANCE)
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
         guild_id = int(member.guild.id)
-        self.connection.execute(
-            "DELETE FROM economy WHERE guild_id = ? AND user_id = ?", (guild_id, member.id))
-        self.connection.commit()
-
-    def _initDatabase(self):
-        self.connection.execute("""CREATE TABLE IF NOT EXISTS ECONOMY (
-        guild_id INTEGER NOT NULL,
-        user_id INTEGER NOT NULL,
-        user_name TEXT NOT NULL,
-        balance INTEGER NOT NULL,
-        last_daily DATE,
-        UNIQUE(guild_id, user_id));""")
+        await self.storage.close_account(guild_id, member.id)
+        self.leaderboardCache.remove(guild_id, member.id)
 
+    async def _initDatabase(self):
+        if self.membersSynced:
+            return
+        self.membersSynced = True
+        started = time.perf_counter()
+        inserted = 0
         guilds = self.bot.guilds
         for guild in guilds:
-            for member in guild.members:
-                self.connection.execute("INSERT OR IGNORE INTO economy (guild_id, user_id, user_name, balance) VALUES (?, ?, ?, ?)", (
-                    guild.id, member.id, member.name, STARTING_BALANCE))
-
-        self.connection.commit()
+            inserted += await self.storage.open_accounts(guild.id, [(
+                member.id, member.name) for member in guild.members], STARTING_BALANCE)
+        print(
+            f"Economy members synced: {inserted} accounts opened for {len(guilds)} guilds in {time.perf_counter() - started:.2f}s")
 
-    def _getBalance(self, guild_id, user_id):
-        cursor = self.connection.execute(
-            "SELECT balance FROM economy WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
-        balance = cursor.fetchone()[0]
-        return balance
-
-    def _setBalance(self, guild_id, user_id, newBalance):
-        self.connection.execute(
-            "UPDATE economy SET balance = ? WHERE user_id = ? AND guild_id = ?", (newBalance, user_id, guild_id))
-        self.connection.commit()
+    async def _getBalance(self, guild_id, user_id):
+        return await self.storage.get_balance(guild_id, user_id)
 
     @discord.app_commands.command(name="balance", description="Shows your current coin balance.")
     async def balance(self, interaction):
         user_id = interaction.user.id
         guild_id = interaction.guild.id
-        balance = self._getBalance(guild_id, user_id)
+        balance = await self._getBalance(guild_id, user_id)
         if balance == None:
             await interaction.response.send_message("Error fetching balance.")
             return
@@ -83,89 +96,77 @@ class Economy(commands.Cog):
     async def gamble(self, interaction, amount: str):
         guild_id = interaction.guild.id
         user_id = interaction.user.id
-        balance = self._getBalance(guild_id, user_id)
-        if not amount.isnumeric():  # Amount not a number
+        if not amount.isnumeric() or int(amount) <= 0:  # Amount not a number
             await interaction.response.send_message("Invalid amount. Make sure it's a number.")
             return
-        if balance == None:  # Error fetching balance
-            await interaction.response.send_message("Error fetching balance.")
-            return
-        if int(amount) > balance or int(amount) <= 0:
-            await interaction.response.send_message("You don't have enough coins.")
-            return
 
+        amount = int(amount)
         outcome = randint(0, 1)
+        newBalance = await self.storage.adjust_balance(guild_id, user_id, amount if outcome else -amount, amount, "gamble")
+        if newBalance == None:  # Not enough coins or no account
+            await interaction.response.send_message("You don't have enough coins.")
+            return
+        self.leaderboardCache.update(
+            guild_id, user_id, interaction.user.name, newBalance)
         if outcome == 0:
             await interaction.response.send_message(f"You lost {amount} coins.")
-            self._setBalance(guild_id, user_id, balance - int(amount))
         else:
             await interaction.response.send_message(f"You won {amount} coins.")
-            self._setBalance(guild_id, user_id, balance + int(amount))
 
     @discord.app_commands.command(name="pay", description="Pay someone else.")
     async def pay(self, interaction, user: discord.User, amount: str):
         guild_id = interaction.guild.id
         user_id = interaction.user.id
-        senderBalance = self._getBalance(guild_id, user_id)
-        receiverBalance = self._getBalance(guild_id, user.id)
-        if not amount.isnumeric():  # Amount not a number
+        if not amount.isnumeric() or int(amount) <= 0:  # Amount not a number
             await interaction.response.send_message("Invalid amount. Make sure it's a number.")
             return
-        if senderBalance == None:  # Error fetching balance
-            await interaction.response.send_message("Error fetching balance.")
+        if user.id == user_id:
+            await interaction.response.send_message("You can't pay yourself.")
             return
-        if int(amount) > senderBalance or int(amount) <= 0:
+
+        try:
+            balances = await self.storage.transfer(guild_id, user_id, user.id, int(amount))
+        except LookupError:
+            await interaction.response.send_message(f"{user.name} does not have an account.")
+            return
+        if balances == None:  # Not enough coins or no account
             await interaction.response.send_message("You don't have enough coins.")
             return
-
-        self._setBalance(guild_id, user_id, senderBalance -
-                         int(amount))  # Subtract from sender
-        self._setBalance(guild_id, user.id, receiverBalance +
-                         int(amount))  # Add to receiver
+        self.leaderboardCache.update(
+            guild_id, user_id, interaction.user.name, balances[0])
+        self.leaderboardCache.update(guild_id, user.id, user.name, balances[1])
         await interaction.response.send_message(f"You paid {user.name} {amount} coins.")
 
     @discord.app_commands.command(name="daily", description="Claim your daily reward.")
     async def daily(self, interaction):
         guild_id = interaction.guild.id
         user_id = interaction.user.id
-        userBalance = self._getBalance(guild_id, user_id)
-
-        cursor = self.connection.execute(
-            "SELECT last_daily FROM economy WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
-        last_daily = cursor.fetchone()[0]
-        last_daily = datetime.datetime.strptime(
-            last_daily, "%Y-%m-%d").date() if last_daily != 'NULL' and last_daily is not None else None
-
-        if last_daily == None:  # Never Collected Daily Reward
-            self.connection.execute("UPDATE economy SET last_daily = ? WHERE user_id = ? AND guild_id = ?", (str(
-                datetime.date.today()), user_id, guild_id))
-            self.connection.commit()
-            self._setBalance(guild_id, user_id, userBalance + DAILY_REWARD)
-            await interaction.response.send_message(f"You claimed your daily reward of {DAILY_REWARD} coins.")
-        else:
-            if last_daily < datetime.date.today():  # Daily Reward claimed before today
-                self.connection.execute("UPDATE economy SET last_daily = ? WHERE user_id = ? AND guild_id = ?", (str(
-                    datetime.date.today()), user_id, guild_id))
-                self.connection.commit()
-                self._setBalance(guild_id, user_id, userBalance + DAILY_REWARD)
-                await interaction.response.send_message(f"You claimed your daily reward of {DAILY_REWARD} coins.")
-            elif last_daily == datetime.date.today():  # Daily Reward already claimed today
-                await interaction.response.send_message("You already claimed your daily reward today.")
-            else:  # Error of some sort
-                self.connection.execute("UPDATE economy SET last_daily = ? WHERE user_id = ? AND guild_id = ?", (str(
-                    datetime.date.today()), user_id, guild_id))
-                await interaction.response.send_message("Error fetching last daily reward. Try again.")
+        try:
+            newBalance = await self.storage.claim_daily(guild_id, user_id, DAILY_REWARD, str(datetime.date.today()))
+        except LookupError:
+            await interaction.response.send_message("Error fetching balance.")
+            return
+        if newBalance == None:  # Daily Reward already claimed today
+            await interaction.response.send_message("You already claimed your daily reward today.")
+            return
+        self.leaderboardCache.update(
+            guild_id, user_id, interaction.user.name, newBalance)
+        await interaction.response.send_message(f"You claimed your daily reward of {DAILY_REWARD} coins.")
 
     @discord.app_commands.command(name="leaderboard", description="Shows the top 10 richest people in the server.")
     async def leaderboard(self, interaction):
         guild_id = interaction.guild.id
-        cursor = self.connection.execute(
-            "SELECT user_name, balance FROM economy WHERE guild_id = ? ORDER BY balance DESC LIMIT 10", (guild_id,))
-        embed = discord.Embed(title=f"{interaction.guild.name}'s Leaderboard",
-                              color=discord.Colour.green(), timestamp=datetime.datetime.utcnow())
-        for row in cursor:
-            embed.add_field(name=row[0], value=row[1])
-        await interaction.response.send_message(embed=embed)
+        board = self.leaderboardCache.get(guild_id)
+        if board is None:
+            rows = await self.storage.get_leaderboard(guild_id, self.leaderboardCache.capacity)
+            board = self.leaderboardCache.load(guild_id, rows)
+        if board.rendered is None:
+            embed = discord.Embed(title=f"{interaction.guild.name}'s Leaderboard",
+                                  color=discord.Colour.green(), timestamp=datetime.datetime.utcnow())
+            for balance, _, user_name in self.leaderboardCache.top(guild_id):
+                embed.add_field(name=user_name, value=balance)
+            board.rendered = embed
+        await interaction.response.send_message(embed=board.rendered)
 
     @discord.app_commands.command(name="beg", description="Beg for coins.")
     async def beg(self, interaction: discord.Interaction, member: discord.Member):
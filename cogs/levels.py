@@ -1,109 +1,193 @@
-from discord.ext import commands
+from discord.ext import commands, tasks
 import discord
-import sqlite3
 import datetime
+import time
+from database import Storage, Leaderboard
 
 # Experience required per level (EXPERIENCE_MULTIPLIER * level)
 EXPERIENCE_MULTIPLIER = 20
 # Experience gained per message
 MESSAGE_EXPERIENCE = 5
+# Seconds between write-behind flushes of accumulated experience
+FLUSH_INTERVAL = 10
+# Number of dirty users that triggers a flush before the interval elapses
+FLUSH_THRESHOLD = 500
+# Seconds for a user to earn back the allowance for one rewarded message
+XP_RATE_INTERVAL = 15
+# Number of rewarded messages a user can send in a burst
+XP_BURST = 3
 
 
 class Levels(commands.Cog):
-    def __init__(self, bot: commands.Bot, dbConnection: sqlite3.Connection):
+    def __init__(self, bot: commands.Bot, storage: Storage):
         self.bot = bot
-        self.connection = dbConnection
+        self.storage = storage
+
+        # Write-behind experience accumulator
+        # (Guild ID, User ID) -> [level, experience]
+        self.experience = {}
+        # Keys changed since the last flush
+        self.dirty = set()
+        # Keys touched since the last flush interval, used to evict idle entries
+        self.recent = set()
+        # on_ready fires on every reconnect, the member backfill only needs to run once
+        self.membersSynced = False
+        # Guild ID -> top (level, experience) scores, kept current by the accumulator
+        self.leaderboardCache = Leaderboard()
+        # Per-user experience rate limit, a token bucket stored as one timestamp per user
+        # (Guild ID, User ID) -> time at which the user's bucket is full again
+        self.xpAllowance = {}
+        self.xpAccepted = 0
+        self.xpDropped = 0
         print("Levels DB Connection Established")
 
-    def __del__(self):
-        print("Levels DB Connection Closed.")
-        self.connection.close()
+    async def cog_load(self):
+        self.flushExperience.start()
+
+    async def cog_unload(self):
+        self.flushExperience.cancel()
+        await self._flushExperience()
+
+    def stats(self) -> dict:
+        return {
+            "accumulated users": len(self.experience),
+            "dirty users": len(self.dirty),
+            "rate limited users": len(self.xpAllowance),
+            "xp messages accepted": self.xpAccepted,
+            "xp messages dropped": self.xpDropped,
+            **{f"lvlboard {key}": value for key, value in self.leaderboardCache.stats().items()},
+        }
 
     @commands.Cog.listener()
     async def on_ready(self):
         print("Levels cog is ready.")
-        self._initDatabase()
+        await self._initDatabase()
 
     @commands.Cog.listener()
     async def on_member_join(self, member):
         guild_id = int(member.guild.id)
         member_id = int(member.id)
-        self.connection.execute(
+        await self.storage.execute(
             "INSERT OR IGNORE INTO levels (guild_id, user_id, user_name, experience, current_lvl) VALUES (?, ?, ?, ?, ?)", (guild_id, member_id, member.name, 0, 0))
-        self.connection.commit()
 
     @commands.Cog.listener()
     async def on_member_remove(self, member):
         guild_id = int(member.guild.id)
         member_id = int(member.id)
-        self.connection.execute(
-            "DELETE FROM levels WHERE guild_id = ? AND user_id = ?", (guild_id, member_id))
-        self.connection.commit()
+        self.experience.pop((guild_id, member_id), None)
+        self.dirty.discard((guild_id, member_id))
+        self.xpAllowance.pop((guild_id, member_id), None)
+        self.leaderboardCache.remove(guild_id, member_id)
+        await self.storage.delete_levels(guild_id, member_id)
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.author.bot:
+        if message.author.bot or message.guild is None:
             return
         guild_id = int(message.guild.id)
         member_id = int(message.author.id)
-        experience = self._getExperience(guild_id, member_id)
-        level = self._getLevel(guild_id, member_id)
-        newExperience = experience + MESSAGE_EXPERIENCE
-        if newExperience >= level*EXPERIENCE_MULTIPLIER:
-            newLevel = level + 1
-            self._setLevel(guild_id, member_id, newLevel)
-            self._setExperience(guild_id, member_id, 0)
-            await message.channel.send(f"{message.author.mention} has leveled up to level {newLevel}!")
-        else:
-            self._setExperience(guild_id, member_id, newExperience)
-
-    def _initDatabase(self):
-        self.connection.execute("""CREATE TABLE IF NOT EXISTS LEVELS (
-        guild_id INTEGER NOT NULL,
-        user_id INTEGER NOT NULL,
-        user_name TEXT NOT NULL,
-        experience INTEGER NOT NULL,
-        current_lvl INTEGER NOT NULL,
-        UNIQUE(guild_id, user_id));""")
-
+        if not self._earnsExperience((guild_id, member_id)):
+            return
+        entry = await self._getEntry(guild_id, member_id)
+        if entry is None:
+            return
+        entry[1] += MESSAGE_EXPERIENCE
+        self.dirty.add((guild_id, member_id))
+        self.recent.add((guild_id, member_id))
+        if entry[1] >= entry[0]*EXPERIENCE_MULTIPLIER:
+            entry[0] += 1
+            entry[1] = 0
+            await message.channel.send(f"{message.author.mention} has leveled up to level {entry[0]}!")
+        self.leaderboardCache.update(
+            guild_id, member_id, message.author.name, (entry[0], entry[1]))
+        if len(self.dirty) >= FLUSH_THRESHOLD:
+            await self._flushExperience()
+
+    @tasks.loop(seconds=FLUSH_INTERVAL)
+    async def flushExperience(self):
+        try:
+            await self._flushExperience()
+        except Exception as e:
+            # An exception would stop the loop for good; the entries stay dirty for the next flush
+            print(f"Could not save experience: {e}")
+        # Drop entries for users that were idle for a whole interval, unless they are unsaved
+        self.experience = {key: self.experience[key]
+                           for key in self.recent | self.dirty if key in self.experience}
+        self.recent = set()
+        # A bucket that has refilled behaves exactly like a missing one
+        now = time.monotonic()
+        self.xpAllowance = {key: full for key,
+                            full in self.xpAllowance.items() if full > now}
+
+    def _earnsExperience(self, key) -> bool:
+        """
+        Takes one token from the user's bucket, returning False if it is empty.
+
+        Each rewarded message pushes the time at which the bucket is full again forward
+        by XP_RATE_INTERVAL; a message is rewarded while that time is less than
+        XP_BURST intervals ahead.
+        """
+        now = time.monotonic()
+        full = max(self.xpAllowance.get(key, now), now)
+        if full - now > (XP_BURST - 1) * XP_RATE_INTERVAL:
+            self.xpDropped += 1
+            return False
+        self.xpAllowance[key] = full + XP_RATE_INTERVAL
+        self.xpAccepted += 1
+        return True
+
+    async def _flushExperience(self):
+        """
+        Writes every dirty accumulator entry in a single transaction.
+        """
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        rows = [(self.experience[key][0], self.experience[key][1], key[0], key[1])
+                for key in dirty if key in self.experience]
+        try:
+            await self.storage.set_levels(rows)
+        except Exception:
+            # Keep the entries dirty so the next flush retries them
+            self.dirty |= dirty
+            raise
+
+    async def _getEntry(self, guild_id, user_id):
+        """
+        Returns the accumulator entry for a user, loading it from the database on first use.
+        """
+        key = (guild_id, user_id)
+        entry = self.experience.get(key)
+        if entry is None:
+            row = await self.storage.get_level(guild_id, user_id)
+            if row is None:
+                return None
+            # Another message may have loaded the entry while we were waiting
+            entry = self.experience.setdefault(key, [row[0], row[1]])
+        return entry
+
+    async def _initDatabase(self):
+        if self.membersSynced:
+            return
+        self.membersSynced = True
+        started = time.perf_counter()
+        inserted = 0
         guilds = self.bot.guilds
         for guild in guilds:
-            for member in guild.members:
-                self.connection.execute(
-                    "INSERT OR IGNORE INTO levels (guild_id, user_id, user_name, experience, current_lvl) VALUES (?, ?, ?, ?, ?)", (guild.id, member.id, member.name, 0, 0))
-        self.connection.commit()
-
-    def _getExperience(self, guild_id, user_id):
-        cursor = self.connection.execute(
-            "SELECT experience FROM levels WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
-        experience = cursor.fetchone()[0]
-        return experience
-
-    def _getLevel(self, guild_id, user_id):
-        cursor = self.connection.execute(
-            "SELECT current_lvl FROM levels WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
-        current_lvl = cursor.fetchone()[0]
-        return current_lvl
-
-    def _setExperience(self, guild_id, user_id, newExperience):
-        self.connection.execute(
-            "UPDATE levels SET experience = ? WHERE user_id = ? AND guild_id = ?", (newExperience, user_id, guild_id))
-        self.connection.commit()
-
-    def _setLevel(self, guild_id, user_id, newLevel):
-        self.connection.execute(
-            "UPDATE levels SET current_lvl = ? WHERE user_id = ? AND guild_id = ?", (newLevel, user_id, guild_id))
-        self.connection.commit()
+            inserted += await self.storage.add_members("levels", ("guild_id", "user_id", "user_name", "experience", "current_lvl"), guild.id, [
+                (guild.id, member.id, member.name, 0, 0) for member in guild.members])
+        print(
+            f"Levels members synced: {inserted} rows written for {len(guilds)} guilds in {time.perf_counter() - started:.2f}s")
 
     @discord.app_commands.command(name="level", description="Shows your current level.")
     async def level(self, interaction):
         user_id = interaction.user.id
         guild_id = interaction.guild.id
-        level = self._getLevel(guild_id, user_id)
-        curExperience = self._getExperience(guild_id, user_id)
-        if level == None:
+        entry = await self._getEntry(guild_id, user_id)
+        if entry == None:
             await interaction.response.send_message("Error getting your level.")
         else:
+            level, curExperience = entry
             embed = discord.Embed(title="Level", color=discord.Colour.green(
             ), timestamp=datetime.datetime.utcnow())
             embed.add_field(name="Level", value=level)
@@ -115,29 +199,39 @@ class Levels(commands.Cog):
     @discord.app_commands.command(name="lvlboard", description="Shows the top 10 users on the server.")
     async def lvlboard(self, interaction):
         guild_id = interaction.guild.id
-        cursor = self.connection.execute(
-            "SELECT user_name, experience, current_lvl FROM levels WHERE guild_id = ? ORDER BY experience DESC LIMIT 10", (guild_id,))
-        rows = cursor.fetchall()
-        embed = discord.Embed(title="Leaderboard", color=discord.Colour.green(
-        ), timestamp=datetime.datetime.utcnow())
-        for row in rows:
-            embed.add_field(
-                name=row[0], value=f"Level: {row[2]}\nExperience: {row[1]}", inline=False)
-        await interaction.response.send_message(embed=embed)
+        board = self.leaderboardCache.get(guild_id)
+        if board is None:
+            await self._flushExperience()
+            rows = await self.storage.fetchall(
+                "SELECT current_lvl, experience, user_id, user_name FROM levels WHERE guild_id = ? ORDER BY current_lvl DESC, experience DESC LIMIT ?", (guild_id, self.leaderboardCache.capacity))
+            board = self.leaderboardCache.load(
+                guild_id, [((row[0], row[1]), row[2], row[3]) for row in rows])
+            # Apply experience gained while the query was running
+            for (entryGuild, user_id), entry in self.experience.items():
+                member = interaction.guild.get_member(user_id)
+                if entryGuild == guild_id and member is not None:
+                    self.leaderboardCache.update(
+                        guild_id, user_id, member.name, (entry[0], entry[1]))
+        if board.rendered is None:
+            embed = discord.Embed(title="Leaderboard", color=discord.Colour.green(
+            ), timestamp=datetime.datetime.utcnow())
+            for (level, experience), _, user_name in self.leaderboardCache.top(guild_id):
+                embed.add_field(
+                    name=user_name, value=f"Level: {level}\nExperience: {experience}", inline=False)
+            board.rendered = embed
+        await interaction.response.send_message(embed=board.rendered)
 
     @discord.app_commands.command(name="rank", description="Shows your rank on the server.")
     async def rank(self, interaction):
         guild_id = interaction.guild.id
-        cursor = self.connection.execute(
-            "SELECT user_name, experience, current_lvl FROM levels WHERE guild_id = ? ORDER BY experience DESC", (guild_id,))
-        rows = cursor.fetchall()
+        entry = await self._getEntry(guild_id, interaction.user.id)
+        if entry is None:
+            await interaction.response.send_message("Error getting your rank.")
+            return
+        await self._flushExperience()
+        rank = await self.storage.get_rank(guild_id, entry[0], entry[1])
         embed = discord.Embed(title="Rank", color=discord.Colour.green(
         ), timestamp=datetime.datetime.utcnow())
-        rank = 1
-        for row in rows:
-            if row[0] == interaction.user.name:
-                break
-            rank += 1
         embed.add_field(
             name="Rank", value=rank)
         await interaction.response.send_message(embed=embed)
@@ -1,52 +1,78 @@
 import discord
-from discord.ext import commands
-import asyncio
+from discord.ext import commands, tasks
 from urllib import parse
 import re
-from yt_dlp import YoutubeDL
 from dotenv import load_dotenv
 from os import getenv
-import googleapiclient.discovery
-from asyncio import run_coroutine_threadsafe
-from random import shuffle
-import json
+from audio import AudioCache, AudioWorkerPool, ExtractorPool, GuildPlayer, MetadataBatcher, QueueSnapshots, ResolveScheduler, SearchCache, SourceFactory, Stream, StreamCache, TimerWheel, Track, YouTubeAPI, snippetInfo
+from audio.player import PLAYER_IDLE_TIMEOUT, VOICE_IDLE_TIMEOUT, VOICE_PAUSED_TIMEOUT
+from audio.scheduler import RESOLVE_CONCURRENCY
+from audio.timers import TIMER_TICK
+from audio.workers import AUDIO_WORKERS, WORKERS_SUPPORTED
+from audio.searches import SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL
+from audio.snapshots import SNAPSHOT_INTERVAL
 
 load_dotenv()
 YOUTUBE_API_KEY = getenv('YOUTUBE_API_KEY')
+# Seconds and number of queries /play search results are cached for
+SEARCH_TTL = float(getenv('SEARCH_CACHE_TTL', SEARCH_CACHE_TTL))
+SEARCH_SIZE = int(getenv('SEARCH_CACHE_SIZE', SEARCH_CACHE_SIZE))
+# "opus" to pass Opus streams through without re-encoding, "pcm" to always transcode in discord.py
+AUDIO_MODE = getenv('AUDIO_MODE', 'opus')
+# Number of processes producing Opus frames for voice sessions, 0 to run FFmpeg from the bot process
+AUDIO_WORKER_PROCESSES = int(getenv('AUDIO_WORKERS', AUDIO_WORKERS))
+# Directory of the local audio cache, which is disabled when unset, and its size cap
+AUDIO_CACHE_DIR = getenv('AUDIO_CACHE_DIR')
+AUDIO_CACHE_SIZE_MB = int(getenv('AUDIO_CACHE_SIZE_MB', 2048))
+# Maximum number of stream resolves and YouTube API requests running at once across all guilds
+RESOLVE_WORKERS = int(getenv('RESOLVE_CONCURRENCY', RESOLVE_CONCURRENCY))
+# Seconds before an idle voice session disconnects, stopped or with an empty queue and while paused,
+# and before a disconnected player drops its queue
+VOICE_IDLE = float(getenv('VOICE_IDLE_TIMEOUT', VOICE_IDLE_TIMEOUT))
+VOICE_PAUSED = float(getenv('VOICE_PAUSED_TIMEOUT', VOICE_PAUSED_TIMEOUT))
+PLAYER_IDLE = float(getenv('PLAYER_IDLE_TIMEOUT', PLAYER_IDLE_TIMEOUT))
+# Seconds between writes of changed queues to the database
+SNAPSHOT_SECONDS = float(getenv('QUEUE_SNAPSHOT_INTERVAL', SNAPSHOT_INTERVAL))
 
 
 class Music(commands.Cog):
-    def __init__(self, bot: commands.Bot) -> None:
+    def __init__(self, bot: commands.Bot, storage=None, youtube=None) -> None:
         """
         Initializes the Music cog.
 
         Args:
             bot (discord.ext.commands.Bot): The bot instance.
+            storage (database.Storage, optional): Storage for persistent caches.
+            youtube (YouTubeAPI, optional): YouTube Data API client. Defaults to the shared client.
         """
         self.bot = bot
-
-        # Holds Playing Status
-        # Guild ID -> Bool
-        self.is_playing = {}
-
-        # Holds Paused Status
-        # Guild ID -> Bool
-        self.is_paused = {}
-
-        # Holds Music Queue
-        # Guild ID -> List of Music Objects
-        self.musicQueue = {}
-
-        # Holds queue Index
-        # Guild ID -> Index (int)
-        self.queueIndex = {}
-
-        # Holds Connected VoiceChannel for a Guild
-        # Guild ID -> VoiceClient Object
-        self.vc = {}
+        self.storage = storage
+        self.youtube = youtube or YouTubeAPI.shared(YOUTUBE_API_KEY)
+        # Shares resolve slots between guilds, starting tracks about to play before prefetches;
+        # yt-dlp extractions, API requests and audio cache downloads all go through it
+        self.scheduler = ResolveScheduler(RESOLVE_WORKERS)
+        # Normalized query -> search results, in memory and in the search_cache table
+        self.searches = SearchCache(storage, SEARCH_TTL, SEARCH_SIZE)
+        # Combines video metadata lookups into videos.list requests of up to 50 IDs, after
+        # checking the metadata saved with queue snapshots
+        self.metadata = MetadataBatcher(
+            self.youtube, storage=storage, scheduler=self.scheduler)
+        # Queues saved to the database and restored per guild after a restart
+        self.snapshots = QueueSnapshots(
+            storage, self.metadata) if storage is not None else None
+
+        # Holds the player of every guild with recent music activity, created on first use
+        # Guild ID -> GuildPlayer
+        self.players = {}
+        # Idle timers of every player, advanced by reapIdle
+        self.timers = TimerWheel()
+        self.idleDisconnects = 0
+        self.evictions = 0
+        self.strayVoiceClients = 0
 
         self.YTDL_OPTIONS = {
-            'format': 'bestaudio/best',
+            # Prefer Opus so the stream can be sent to Discord without re-encoding
+            'format': 'bestaudio[acodec=opus]/bestaudio/best',
             'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
             'quiet': True,
             'postprocessors': [{
@@ -57,24 +83,129 @@ class Music(commands.Cog):
         }
         self.FFMPEG_OPTIONS = {
             'before_options':
-            '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -probesize 200M',
+            # A small probe is enough to find the single audio stream, so playback starts sooner
+            '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -probesize 256k -analyzeduration 0',
             'options': '-vn'
         }
 
-    @commands.Cog.listener()
-    async def on_ready(self):
+        # Runs yt-dlp off the event loop with reusable extractor instances; one thread per
+        # scheduler slot, so admitted extractions never queue behind each other
+        self.extractor = ExtractorPool(self.YTDL_OPTIONS, RESOLVE_WORKERS)
+        # Video ID -> stream URL, refreshed before the URL's expire timestamp
+        self.streams = StreamCache(
+            self._resolveStream, prioritize=self.scheduler.promote)
+        # Decodes and encodes audio outside the bot process when enabled
+        self.workers = None
+        if AUDIO_WORKER_PROCESSES > 0 and not WORKERS_SUPPORTED:
+            print("AUDIO_WORKERS is only supported on Linux and macOS, running FFmpeg from the bot process.")
+        elif AUDIO_WORKER_PROCESSES > 0:
+            self.workers = AudioWorkerPool(AUDIO_WORKER_PROCESSES)
+        # Builds passthrough or transcoding FFmpeg sources depending on the stream codec
+        self.sources = SourceFactory(
+            AUDIO_MODE, **self.FFMPEG_OPTIONS, workers=self.workers)
+        # Opus files of frequently played tracks, preferred over remote streams
+        self.audioCache = None
+        if AUDIO_CACHE_DIR and storage is not None:
+            self.audioCache = AudioCache(
+                AUDIO_CACHE_DIR, AUDIO_CACHE_SIZE_MB * 2**20, storage, self.YTDL_OPTIONS, scheduler=self.scheduler)
+
+        # Track change latency, from the end of one track to the start of the next
+        self.trackSwitches = 0
+        self.prefetchedSwitches = 0
+        self.switchTime = 0.0
+
+    async def cog_load(self) -> None:
+        if self.audioCache:
+            await self.audioCache.load()
+        if self.snapshots:
+            await self.snapshots.load()
+            self.saveSnapshots.start()
+        self.reapIdle.start()
+
+    async def cog_unload(self) -> None:
+        self.reapIdle.cancel()
+        if self.snapshots:
+            self.saveSnapshots.cancel()
+            await self.snapshots.flush()
+        for player in list(self.players.values()):
+            player.close()
+        self.extractor.close()
+        if self.audioCache:
+            self.audioCache.close()
+        if self.workers:
+            await self.workers.close()
+
+    def stats(self) -> dict:
+        return {
+            **self.youtube.stats(),
+            **self.metadata.stats(),
+            **self.searches.stats(),
+            **self.scheduler.stats(),
+            **self.extractor.stats(),
+            **self.streams.stats(),
+            **self.sources.stats(),
+            **(self.workers.stats() if self.workers else {}),
+            **(self.audioCache.stats() if self.audioCache else {}),
+            **self.timers.stats(),
+            **(self.snapshots.stats() if self.snapshots else {}),
+            "players": len(self.players),
+            "voice sessions": sum(player.connected for player in self.players.values()),
+            "voice clients": len(self.bot.voice_clients),
+            "idle disconnects": self.idleDisconnects,
+            "idle evictions": self.evictions,
+            "stray voice clients": self.strayVoiceClients,
+            "track switches": self.trackSwitches,
+            "prefetched switches": self.prefetchedSwitches,
+            "avg switch (ms)": round(self.switchTime / max(self.trackSwitches, 1) * 1000, 1),
+        }
+
+    def getPlayer(self, guild_id: int) -> GuildPlayer:
+        """
+        Returns the player of a guild, creating it on first use.
         """
-        Called when the bot is ready.
+        player = self.players.get(guild_id)
+        if player is None:
+            player = GuildPlayer(self, guild_id, PLAYER_IDLE,
+                                 VOICE_IDLE, VOICE_PAUSED)
+        return player
 
-        Initializes the music queue, queue index, and voice client for each guild that the bot is a member of.
+    async def findPlayer(self, guild_id: int) -> GuildPlayer:
         """
-        print("Music cog is ready.")
-        for guild in self.bot.guilds:
-            id = int(guild.id)
-            self.musicQueue[id] = []
-            self.queueIndex[id] = 0
-            self.vc[id] = None
-            self.is_playing[id] = self.is_paused[id] = False
+        Returns the player of a guild, or None if it has none.
+
+        A guild with a saved queue gets its player back, with the queue restored.
+        """
+        if self.snapshots is not None and guild_id in self.snapshots.pending:
+            player = self.getPlayer(guild_id)
+        else:
+            player = self.players.get(guild_id)
+        if player is not None and player.restored is not None:
+            await player.restored
+        return player
+
+    @tasks.loop(seconds=SNAPSHOT_SECONDS)
+    async def saveSnapshots(self) -> None:
+        await self.snapshots.flush()
+
+    @tasks.loop(seconds=TIMER_TICK)
+    async def reapIdle(self) -> None:
+        """
+        Advances the idle timers, then disconnects voice clients and kills FFmpeg processes no player owns.
+        """
+        self.timers.advance()
+        active = set()
+        for voice in list(self.bot.voice_clients):
+            player = self.players.get(voice.guild.id)
+            # A player whose voice is still None may be connecting this client right now
+            if player is None or (player.voice is not None and player.voice is not voice):
+                self.strayVoiceClients += 1
+                try:
+                    await voice.disconnect(force=True)
+                except Exception as e:
+                    print(e)
+            elif getattr(voice, "source", None) is not None:
+                active.add(voice.source)
+        self.sources.reap(active)
 
     @commands.Cog.listener()
     async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
@@ -88,29 +219,30 @@ class Music(commands.Cog):
             before (discord.VoiceState): The member's voice state before the change.
             after (discord.VoiceState): The member's voice state after the change.
         """
-        id = int(member.guild.id)
+        player = self.players.get(int(member.guild.id))
+        if player is None:
+            return
         if member.id != self.bot.user.id and before.channel != None and after.channel != before.channel:
             remainingChannelMembers = before.channel.members
-            if len(remainingChannelMembers) == 1 and remainingChannelMembers[0].id == self.bot.user.id and self.vc[id].is_connected():
-                self.is_playing[id] = self.is_paused[id] = False
-                self.musicQueue[id] = []
-                self.queueIndex[id] = 0
-                await self.vc[id].disconnect()
+            if len(remainingChannelMembers) == 1 and remainingChannelMembers[0].id == self.bot.user.id and player.connected:
+                await player.submit(player.clear)
+                await player.submit(player.disconnect)
 
     @discord.app_commands.command(name="join", description="Joins the current voice channel.")
     async def join(self, interaction: discord.Interaction) -> None:
         """
-        Stops the current song.
+        Joins the current voice channel.
 
         Args:
             interaction (discord.Interaction): The interaction object.
         """
         guild_id = int(interaction.guild.id)
         if interaction.user.voice:
+            await interaction.response.defer()
             userChannel = interaction.user.voice.channel  # VoiceChannel Object
-            # VoiceClient Object
-            self.vc[guild_id] = await userChannel.connect()
-            await interaction.response.send_message(f'Bot has joined {userChannel}')
+            player = self.getPlayer(guild_id)
+            await player.submit(player.connect, userChannel)
+            await interaction.followup.send(f'Bot has joined {userChannel}')
         else:
             await interaction.response.send_message("You are not connected to a voice channel.")
 
@@ -122,36 +254,40 @@ class Music(commands.Cog):
         Args:
             interaction (discord.Interaction): The interaction object.
         """
-        guild_id = int(interaction.guild.id)
-        if self.vc[guild_id] != None:
-            await self.vc[guild_id].disconnect()
-            await interaction.response.send_message("Bot has left the chat.")
-            self.vc[guild_id] = None
+        await interaction.response.defer()
+        player = await self.findPlayer(int(interaction.guild.id))
+        if player is not None and await player.submit(player.disconnect):
+            await interaction.followup.send("Bot has left the chat.")
         else:
-            await interaction.response.send_message("Bot is not connected to a voice channel.")
+            await interaction.followup.send("Bot is not connected to a voice channel.")
 
-    def search_YT(self, query: str) -> list:
+    async def search_YT(self, query: str, guild_id: int = None) -> list:
         """
         Searches YouTube for videos matching a given query. Returns a list of up to 10 video URLs.
 
+        Results are cached by normalized query, so repeated searches cost no API quota.
+
         Args:
             query (str): The search query.
+            guild_id (int, optional): The guild searching, for fair scheduling.
 
         Returns:
             list: A list of up to 10 video URLs.
         """
-        query = parse.quote(query)
-        youtube = googleapiclient.discovery.build(
-            "youtube", "v3", developerKey=YOUTUBE_API_KEY)
-        try:
-            request = youtube.search().list(
-                part="snippet",
-                q=query
-            )
-            response = request.execute()
-        except:
-            return []
-        return [f"https://www.youtube.com/watch?v={item['id']['videoId']}" for item in response['items']]
+        results = await self.searches.get(query)
+        if results is None:
+            try:
+                response = await self.scheduler.run(guild_id, lambda: self.youtube.search(query), urgent=True)
+            except:
+                return []
+            results = [snippetInfo(item['id']['videoId'], item['snippet'])
+                       for item in response['items']]
+            if results:
+                await self.searches.put(query, results)
+        # Search results carry the snippet getSongInfo needs, so keep it
+        for info in results:
+            self.metadata.prime(info)
+        return [f"https://www.youtube.com/watch?v={info['video_id']}" for info in results]
 
     def isValidYTURL(self, url: str) -> bool:
         """
@@ -189,84 +325,116 @@ class Music(commands.Cog):
         """
         return re.match(r"https:\/\/(www\.){0,1}youtube.com\/playlist.*", url) != None
 
-    async def getStreamURL(self, url: str, interaction: discord.Interaction) -> str:
-        with YoutubeDL(self.YTDL_OPTIONS) as ydl:
-            try:
-                stream_url = None
-                data = ydl.extract_info(url, download=False)
-                if data:
-                    stream_url = data['url']
-                return stream_url
-            except:
-                await interaction.followup.send("Could not download the song. Incorrect format, try some different keywords.")
-                return
+    def getVideoID(self, url: str) -> str:
+        """
+        Extracts the video ID from a YouTube video URL.
 
-    def getSongInfo(self, url: str, interaction: discord.Interaction) -> dict:
-        video_id = url.split("=")[1]
-        youtube = googleapiclient.discovery.build(
-            "youtube", "v3", developerKey=YOUTUBE_API_KEY)
-        request = youtube.videos().list(
-            part="snippet",
-            id=video_id
-        )
-        response = request.execute()
-        if response:
-            return {"video_id": response['items'][0]['id'], "url": url, "title": response['items'][0]['snippet']['title'], "artist": response['items'][0]['snippet']['channelTitle'], "thumbnail": response['items'][0]['snippet']['thumbnails']['default']['url']}
-        return {}
-
-    def getPlaylistInfo(self, url: str, interaction: discord.Interaction) -> list:
-        playlist_id = url.split("=")[1]
-        youtube = googleapiclient.discovery.build(
-            "youtube", "v3", developerKey=YOUTUBE_API_KEY)
-        response = youtube.playlistItems().list(
-            part="snippet",
-            maxResults="50",
-            playlistId=playlist_id
-        ).execute()
-        nextPageToken = response.get('nextPageToken')
-        while 'nextPageToken' in response:
-            nextPage = youtube.playlistItems().list(
-                part="snippet",
-                playlistId=playlist_id,
-                maxResults="50",
-                pageToken=nextPageToken
-            ).execute()
-            response['items'] = response['items'] + nextPage['items']
-            if 'nextPageToken' not in nextPage:
-                response.pop('nextPageToken', None)
-            else:
-                nextPageToken = nextPage['nextPageToken']
-        return response
-
-    async def _play(self, guild_id: int, interaction: discord.Interaction):
-        if self.is_playing[guild_id] == False:
-            songInfo = self.musicQueue[guild_id][self.queueIndex[guild_id]]
-            try:
-                self.is_playing[guild_id] = True
-                self.is_paused[guild_id] = False
-                songInfo['stream_url'] = await self.getStreamURL(songInfo['url'], interaction)
-                self.vc[guild_id].play(discord.FFmpegPCMAudio(
-                    songInfo['stream_url'], **self.FFMPEG_OPTIONS), after=lambda e: asyncio.run_coroutine_threadsafe(self._playNext(guild_id, interaction), self.bot.loop))
-            except Exception as e:
-                print(e)
-                self.is_playing[guild_id] = False
-                self.is_paused[guild_id] = False
-                await interaction.followup.send("Could not play the song. Please try again.")
-                return
-            await interaction.followup.send("Now playing!")
+        Args:
+            url (str): The video URL.
 
-        else:
-            await interaction.followup.send("Added to queue.")
+        Returns:
+            str: The video ID, or None if the URL has none.
+        """
+        return parse.parse_qs(parse.urlparse(url).query).get('v', [None])[0]
+
+    async def _resolveStream(self, video_id: str, guild_id: int, urgent: bool) -> Stream:
+        info = await self.scheduler.run(guild_id, lambda: self.extractor.extract(f"https://www.youtube.com/watch?v={video_id}"), urgent, key=video_id)
+        if not info or not info.get('url'):
+            return None
+        return Stream(info['url'], info.get('acodec'), info.get('abr'))
+
+    async def getStream(self, url: str, interaction: discord.Interaction) -> Stream:
+        """
+        Returns the direct audio stream of a YouTube video.
+
+        Cached streams are reused until shortly before they expire; otherwise the stream is
+        resolved on the extractor pool, sharing any resolve already running for the video.
+
+        Args:
+            url (str): The video URL.
+            interaction (discord.Interaction): The interaction to report failures to.
 
-    async def _playNext(self, guild_id: int, interaction: discord.Interaction):
-        self.is_playing[guild_id] = False
-        if not self.musicQueue[guild_id][self.queueIndex[guild_id] + 1]:
-            await interaction.response.send_message("No more songs in queue.")
+        Returns:
+            Stream: The stream URL and codec, or None if it could not be resolved.
+        """
+        try:
+            return await self.streams.get(self.getVideoID(url), int(interaction.guild.id))
+        except Exception as e:
+            print(e)
+            await interaction.followup.send("Could not download the song. Incorrect format, try some different keywords.")
             return
-        self.queueIndex[guild_id] += 1
-        await self._play(guild_id, interaction)
 
-    # TODO: Fix up with above functions
+    async def checkStream(self, track: Track, interaction: discord.Interaction) -> bool:
+        """
+        Resolves the stream of a track before it is queued, so broken videos are reported right away.
+
+        Tracks in the local audio cache need no stream.
+
+        Args:
+            track (Track): The track to check.
+            interaction (discord.Interaction): The interaction to report failures to.
+
+        Returns:
+            bool: True if the track can be played.
+        """
+        if self.audioCache and track.video_id in self.audioCache.files:
+            return True
+        return await self.getStream(track.url, interaction) is not None
+
+    async def getSongInfo(self, url: str, interaction: discord.Interaction) -> Track:
+        """
+        Returns the queue entry of a YouTube video.
+
+        Lookups are batched with those of other guilds, and videos seen in recent
+        searches or playlist pages are answered from memory.
+
+        Args:
+            url (str): The video URL.
+            interaction (discord.Interaction): The interaction object.
+
+        Raises:
+            LookupError: The video does not exist or is private.
+
+        Returns:
+            Track: The video as a queue entry.
+        """
+        info = await self.metadata.get(self.getVideoID(url))
+        if info is None:
+            raise LookupError(f"No video found for {url}")
+        return Track.fromInfo(info)
+
+    async def getPlaylistInfo(self, url: str, guild_id: int = None):
+        """
+        Yields the queue entries of a YouTube playlist, one page of up to 50 songs at a time.
+
+        Deleted and private videos are skipped. Only the first page is fetched urgently;
+        the rest wait behind other guilds' playback.
+
+        Args:
+            url (str): The playlist URL.
+            guild_id (int, optional): The guild loading the playlist, for fair scheduling.
+
+        Yields:
+            list: The queue entries of the next page.
+        """
+        playlist_id = parse.parse_qs(
+            parse.urlparse(url).query).get('list', [None])[0]
+        pageToken = None
+        while True:
+            response = await self.scheduler.run(guild_id, lambda: self.youtube.playlistItems(playlist_id, pageToken), urgent=pageToken is None)
+            songs = []
+            for item in response.get('items', []):
+                # Deleted and private videos have no owner
+                if 'videoOwnerChannelTitle' not in item['snippet']:
+                    continue
+                video_id = item['snippet']['resourceId']['videoId']
+                songInfo = snippetInfo(video_id, item['snippet'])
+                self.metadata.prime(songInfo)
+                songs.append(Track.fromInfo(songInfo))
+            yield songs
+            pageToken = response.get('nextPageToken')
+            if pageToken is None:
+                return
 
     @discord.app_commands.command(name="play", description="Plays a song from a link.")
     async def play(self, interaction, query: str):
@@ -288,48 +456,56 @@ class Music(commands.Cog):
             await interaction.followup.send("You must be connected to a voice channel.")
             return
         userChannel = interaction.user.voice.channel  # VoiceChannel Object
-        if self.vc[guild_id] == None:  # If bot not in channel, join channel
-            # VoiceClient Object
-            self.vc[guild_id] = await userChannel.connect()
-        else:  # If bot in diff channel, switch voice channel
-            await self.vc[guild_id].move_to(userChannel)
+        # Joins the channel, or switches to it if the bot is in a different one
+        player = self.getPlayer(guild_id)
+        await player.submit(player.connect, userChannel)
 
         if self.isValidYTURL(query):  # Valid youtubeURL
             if self.isYTPlaylistURL(query):  # Playlist URL
-                playListInfo = self.getPlaylistInfo(query, interaction)
-                print(len(playListInfo['items']))
-                print(json.dumps(playListInfo))
-                if 'items' not in playListInfo or playListInfo == None:
+                pages = self.getPlaylistInfo(query, guild_id)
+                # Start playing as soon as the first page with playable songs arrives
+                try:
+                    songs = []
+                    while not songs:
+                        songs = await pages.__anext__()
+                except StopAsyncIteration:
+                    await interaction.followup.send("No playable songs found in playlist.")
+                    return
+                except Exception as e:
+                    print(e)
+                    await pages.aclose()
                     await interaction.followup.send("Could not get playlist information. Please try again.")
                     return
-                # Get URL for each song in playlist
-                for item in playListInfo['items']:
-                    url = f"https://www.youtube.com/watch?v={item['snippet']['resourceId']['videoId']}"
-                    # Get Song Information -> {}
-                    songInfo = {"title": item['snippet']['title'], "artist": item['snippet']
-                                ['videoOwnerChannelTitle'], "thumbnail": item['snippet']['thumbnails']['default']['url'], "url": url}
-                    # Add to Queue / Play
-                    self.musicQueue[guild_id].append(songInfo)
-                await self._play(guild_id, interaction)
+                # Add to Queue / Play
+                added = await player.submit(player.enqueue, songs)
+                if not added:
+                    await pages.aclose()
+                    await interaction.followup.send("The queue is full.")
+                    return
+                await player.submit(player.start, interaction)
+                # Stream the remaining pages into the queue
+                player.load(pages, added, interaction)
             elif self.isYTVideoURL(query):  # Video URL
                 # Get Song Information -> {}
                 try:
-                    songInfo = self.getSongInfo(query, interaction)
-                    songInfo['stream_url'] = await self.getStreamURL(query, interaction)
+                    songInfo = await self.getSongInfo(query, interaction)
+                    playable = await self.checkStream(songInfo, interaction)
                 except Exception as e:
                     print(e)
                     await interaction.followup.send("Could not get song information. Please try again.")
                     return
-                if 'stream_url' not in songInfo or songInfo == {}:
+                if not playable:
                     await interaction.followup.send("Could not find stream URL. Please try again.")
                     return
                 # Add to Queue / Play
-                self.musicQueue[guild_id].append(songInfo)
-                await self._play(guild_id, interaction)
+                if not await player.submit(player.enqueue, [songInfo]):
+                    await interaction.followup.send("The queue is full.")
+                    return
+                await player.submit(player.start, interaction)
         else:  # Requires searching
             # Search YT -> [urls]
             try:
-                urls = self.search_YT(query)
+                urls = await self.search_YT(query, guild_id)
             except Exception as e:
                 print(e)
                 await interaction.followup.send("Could not search YouTube. Please try again.")
@@ -341,20 +517,22 @@ class Music(commands.Cog):
 
             # Get Song Information -> {}
             try:
-                songInfo = self.getSongInfo(urls[0], interaction)
-                songInfo['stream_url'] = await self.getStreamURL(urls[0], interaction)
+                songInfo = await self.getSongInfo(urls[0], interaction)
+                playable = await self.checkStream(songInfo, interaction)
             except Exception as e:
                 print(e)
                 await interaction.followup.send("Could not get song information. Please try again.")
                 return
 
-            if 'stream_url' not in songInfo or songInfo['stream_url'] == None:
+            if not playable:
                 await interaction.followup.send("Could not find stream URL. Please try again.")
                 return
 
             # Add to Queue / Play
-            self.musicQueue[guild_id].append(songInfo)
-            await self._play(guild_id, interaction)
+            if not await player.submit(player.enqueue, [songInfo]):
+                await interaction.followup.send("The queue is full.")
+                return
+            await player.submit(player.start, interaction)
 
     @discord.app_commands.command(name="pause", description="Pauses the current song.")
     async def pause(self, interaction: discord.Interaction) -> None:
@@ -364,19 +542,18 @@ class Music(commands.Cog):
         Args:
             interaction (discord.Interaction): The interaction object.
         """
-        guild_id = int(interaction.guild.id)
-        if self.is_playing[guild_id] == False:
-            await interaction.response.send_message("There is no audio to be paused at the moment.")
+        await interaction.response.defer()
+        player = await self.findPlayer(int(interaction.guild.id))
+        try:
+            paused = player is not None and await player.submit(player.pause)
+        except Exception as e:
+            print(e)
+            await interaction.followup.send("Could not pause the song.")
+            return
+        if paused:
+            await interaction.followup.send("Audio paused!")
         else:
-            try:
-                self.vc[guild_id].pause()
-                self.is_playing[guild_id] = False
-                self.is_paused[guild_id] = True
-                await interaction.response.send_message("Audio paused!")
-            except Exception as e:
-                print(e)
-                await interaction.response.send_message("Could not pause the song.")
-                return
+            await interaction.followup.send("There is no audio to be paused at the moment.")
 
     @discord.app_commands.command(name="resume", description="Resumes the current song.")
     async def resume(self, interaction: discord.Interaction) -> None:
@@ -386,19 +563,18 @@ class Music(commands.Cog):
         Args:
             interaction (discord.Interaction): The interaction object.
         """
-        guild_id = int(interaction.guild.id)
-        if self.is_paused[guild_id] == False:
-            await interaction.response.send_message("There is no audio to be resumed at the moment.")
+        await interaction.response.defer()
+        player = await self.findPlayer(int(interaction.guild.id))
+        try:
+            resumed = player is not None and await player.submit(player.resume)
+        except Exception as e:
+            print(e)
+            await interaction.followup.send("Could not resume the song.")
+            return
+        if resumed:
+            await interaction.followup.send("Audio resumed!")
         else:
-            try:
-                self.vc[guild_id].resume()
-                self.is_playing[guild_id] = True
-                self.is_paused[guild_id] = False
-                await interaction.response.send_message("Audio resumed!")
-            except Exception as e:
-                print(e)
-                await interaction.response.send_message("Could not resume the song.")
-                return
+            await interaction.followup.send("There is no audio to be resumed at the moment.")
 
     @discord.app_commands.command(name="stop", description="Stops the current song.")
     async def stop(self, interaction: discord.Interaction) -> None:
@@ -408,53 +584,61 @@ class Music(commands.Cog):
         Args:
             interaction (discord.Interaction): The interaction object.
         """
-        guild_id = int(interaction.guild.id)
-        if self.is_playing[guild_id] == False:
-            await interaction.response.send_message("There is no audio to be stopped at the moment.")
+        await interaction.response.defer()
+        player = await self.findPlayer(int(interaction.guild.id))
+        try:
+            stopped = player is not None and await player.submit(player.stop)
+        except Exception as e:
+            print(e)
+            await interaction.followup.send("Could not stop the song.")
+            return
+        if stopped:
+            await interaction.followup.send("Audio stopped!")
         else:
-            try:
-                self.vc[guild_id].stop()
-                self.is_playing[guild_id] = False
-                self.is_paused[guild_id] = False
-                await interaction.response.send_message("Audio stopped!")
-            except Exception as e:
-                print(e)
-                await interaction.response.send_message("Could not stop the song.")
-                return
+            await interaction.followup.send("There is no audio to be stopped at the moment.")
 
     @discord.app_commands.command(name="queue", description="Displays the current music queue.")
-    async def queue(self, interaction: discord.Interaction, num: str = "10") -> None:
+    async def queue(self, interaction: discord.Interaction, num: str = "10", page: str = "1") -> None:
         """
         Displays the current music queue.
 
         Args:
             interaction (discord.Interaction): The interaction object.
-            num (str, optional): The number of songs to display. Defaults to 10.
+            num (str, optional): The number of songs per page. Defaults to 10.
+            page (str, optional): The page of upcoming songs to display. Defaults to 1.
         """
         if (not num.isnumeric()) or num == "" or int(num) < 1:
             await interaction.response.send_message("Invalid number of songs.")
             return
-        num = int(num)
-        guild_id = int(interaction.guild.id)
+        if (not page.isnumeric()) or int(page) < 1:
+            await interaction.response.send_message("Invalid page.")
+            return
+        # Embeds hold at most 25 fields, one of which is the current song
+        num = min(int(num), 24)
+        page = int(page)
+        # Restoring a saved queue may look up songs through the YouTube API
+        await interaction.response.defer()
+        player = await self.findPlayer(int(interaction.guild.id))
         embed = discord.Embed(
             title="Music Queue",
             colour=discord.Colour.blue())
-        if len(self.musicQueue[guild_id]) == 0:
+        if player is None or len(player.queue) == 0:
             embed.add_field(name="No songs in queue.",
                             value="Add some songs with /play or /add.")
-            await interaction.response.send_message(embed=embed)
+            await interaction.followup.send(embed=embed)
             return
-        # embed.thumbnail = self.musicQueue[guild_id][0]['thumbnail']
-        for i, song in enumerate(self.musicQueue[guild_id][self.queueIndex[guild_id]:]):
-            if i == 0:
-                embed.add_field(name=f"{i+1}. {song['title']} (Now Playing)",
-                                value=f"Artist: {song['artist']}\nURL: {song['url']}", inline=False)
-                continue
-            if i >= num:
-                break
-            embed.add_field(name=f"{i+1}. {song['title']}",
-                            value=f"Artist: {song['artist']}\nURL: {song['url']}", inline=False)
-        await interaction.response.send_message(embed=embed)
+        queue = player.queue
+        if queue.current is not None and page == 1:
+            embed.add_field(name=f"1. {queue.current.title} (Now Playing)",
+                            value=f"Artist: {queue.current.artist}\nURL: {queue.current.url}", inline=False)
+        start = (page - 1) * num
+        for i, song in enumerate(queue.peek(num, start), start + 2):
+            embed.add_field(name=f"{i}. {song.title}",
+                            value=f"Artist: {song.artist}\nURL: {song.url}", inline=False)
+        pages = max((len(queue.upcoming) + num - 1) // num, 1)
+        embed.set_footer(
+            text=f"Page {page}/{pages} - {len(queue.upcoming)} upcoming songs")
+        await interaction.followup.send(embed=embed)
 
     @discord.app_commands.command(name="clear", description="Clears the current music queue.")
     async def clear(self, interaction: discord.Interaction) -> None:
@@ -464,15 +648,10 @@ class Music(commands.Cog):
         Args:
             interaction (discord.Interaction): The interaction object.
         """
-        guild_id = int(interaction.guild.id)
         await interaction.response.defer()
-        if self.is_playing[guild_id] == True:
-            self.vc[guild_id].stop()
-            self.is_playing[guild_id] = False
-            self.is_paused[guild_id] = False
-        guild_id = int(interaction.guild.id)
-        self.musicQueue[guild_id] = []
-        self.queueIndex[guild_id] = 0
+        player = await self.findPlayer(int(interaction.guild.id))
+        if player is not None:
+            await player.submit(player.clear)
         await interaction.followup.send("Music queue cleared!")
 
     @discord.app_commands.command(name="skip", description="Skips the current song.")
@@ -484,14 +663,11 @@ class Music(commands.Cog):
             interaction (discord.Interaction): The interaction object.
         """
         await interaction.response.defer()
-        guild_id = int(interaction.guild.id)
-        if self.queueIndex[guild_id] + 1 >= len(self.musicQueue[guild_id]):
+        player = await self.findPlayer(int(interaction.guild.id))
+        if player is None or not player.connected:
             await interaction.followup.send("No more songs in queue.")
             return
-        self.queueIndex[guild_id] += 1
-        self.vc[guild_id].stop()
-        self.is_playing[guild_id] = False
-        await self._play(guild_id, interaction)
+        await player.submit(player.skip, interaction)
 
     @discord.app_commands.command(name="prev", description="Plays the previous song.")
     async def prev(self, interaction: discord.Interaction):
@@ -502,14 +678,11 @@ class Music(commands.Cog):
             interaction (discord.Interaction): The interaction object.
         """
         await interaction.response.defer()
-        guild_id = int(interaction.guild.id)
-        if self.queueIndex[guild_id] - 1 < 0:
+        player = await self.findPlayer(int(interaction.guild.id))
+        if player is None or not player.connected:
             await interaction.followup.send("No previous songs in queue.")
             return
-        self.queueIndex[guild_id] -= 1
-        self.vc[guild_id].stop()
-        self.is_playing[guild_id] = False
-        await self._play(guild_id, interaction)
+        await player.submit(player.previous, interaction)
 
     @discord.app_commands.command(name="shuffle", description="Shuffles the current music queue.")
     async def shuffle(self, interaction: discord.Interaction):
@@ -520,13 +693,8 @@ class Music(commands.Cog):
             interaction (discord.Interaction): The interaction object.
         """
         await interaction.response.defer()
-        guild_id = int(interaction.guild.id)
-        if len(self.musicQueue[guild_id]) == 0:
+        player = await self.findPlayer(int(interaction.guild.id))
+        if player is None or not await player.submit(player.shuffle):
             await interaction.followup.send("No songs in queue.")
             return
-        if self.is_playing[guild_id] == True:
-            self.vc[guild_id].stop()
-            self.is_playing[guild_id] = False
-            self.is_paused[guild_id] = False
-        shuffle(self.musicQueue[guild_id][self.queueIndex[guild_id]:])
         await interaction.followup.send("Queue shuffled!")
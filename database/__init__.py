@@ -0,0 +1,3 @@
+from .storage import Storage
+from .leaderboard import Leaderboard
+from .cache import ProfileCache
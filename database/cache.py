@@ -0,0 +1,84 @@
+import time
+from collections import OrderedDict
+
+# Number of (guild, user) profiles kept in memory
+PROFILE_CACHE_SIZE = 10000
+# Seconds a cached profile stays valid
+PROFILE_CACHE_TTL = 300
+
+# Returned by ProfileCache.get when a field is not cached
+MISSING = object()
+
+
+class Profile:
+    __slots__ = ("expires", "balance", "level", "experience")
+
+    def __init__(self, expires: float) -> None:
+        self.expires = expires
+        self.balance = MISSING
+        self.level = MISSING
+        self.experience = MISSING
+
+
+class ProfileCache:
+    def __init__(self, maxSize: int = PROFILE_CACHE_SIZE, ttl: float = PROFILE_CACHE_TTL) -> None:
+        """
+        Bounded, write-through cache of user profiles keyed by (guild_id, user_id).
+
+        Least recently used profiles are evicted once maxSize is reached, and a profile
+        expires ttl seconds after it was last written.
+
+        Args:
+            maxSize (int, optional): Maximum number of cached profiles.
+            ttl (float, optional): Seconds before a profile has to be read again.
+        """
+        self.maxSize = maxSize
+        self.ttl = ttl
+        self.profiles = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, guild_id: int, user_id: int, field: str):
+        """
+        Returns a cached field of a profile, or MISSING.
+        """
+        key = (guild_id, user_id)
+        profile = self.profiles.get(key)
+        if profile is not None and profile.expires < time.monotonic():
+            del self.profiles[key]
+            profile = None
+        value = getattr(profile, field) if profile is not None else MISSING
+        if value is MISSING:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.profiles.move_to_end(key)
+        return value
+
+    def put(self, guild_id: int, user_id: int, **fields) -> None:
+        """
+        Stores fields of a profile and restarts its TTL.
+        """
+        key = (guild_id, user_id)
+        profile = self.profiles.get(key)
+        if profile is None:
+            profile = self.profiles[key] = Profile(0)
+            if len(self.profiles) > self.maxSize:
+                self.profiles.popitem(last=False)
+        else:
+            self.profiles.move_to_end(key)
+        profile.expires = time.monotonic() + self.ttl
+        for field, value in fields.items():
+            setattr(profile, field, value)
+
+    def invalidate(self, guild_id: int, user_id: int) -> None:
+        self.profiles.pop((guild_id, user_id), None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached profiles": len(self.profiles),
+            "cache hits": self.hits,
+            "cache misses": self.misses,
+            "cache hit rate": f"{self.hits / lookups:.1%}" if lookups else "-",
+        }
@@ -0,0 +1,142 @@
+from collections import OrderedDict
+
+# Number of entries shown on a leaderboard
+LEADERBOARD_SIZE = 10
+# Entries tracked per guild. The slack above LEADERBOARD_SIZE absorbs members dropping
+# out of the top without forcing a rebuild.
+LEADERBOARD_CAPACITY = 25
+# Guilds kept in memory before the least recently used one is evicted
+LEADERBOARD_GUILDS = 256
+
+
+class Board:
+    __slots__ = ("entries", "complete", "rendered")
+
+    def __init__(self, entries: list, complete: bool) -> None:
+        # [key, user_id, user_name] lists sorted by key, highest first
+        self.entries = entries
+        # True when entries hold every member of the guild
+        self.complete = complete
+        # Cached rendering of the top entries, cleared whenever they change
+        self.rendered = None
+
+
+class Leaderboard:
+    def __init__(self, size: int = LEADERBOARD_SIZE, capacity: int = LEADERBOARD_CAPACITY, maxGuilds: int = LEADERBOARD_GUILDS) -> None:
+        """
+        Incrementally maintained top-N rankings, one board per guild.
+
+        A board holds the exact top K members of a guild, with size <= K <= capacity.
+        Writes update it in place; a member whose new score falls below the lowest
+        tracked score is dropped since untracked members might now rank above it. Once
+        fewer than size entries remain the board is evicted and rebuilt lazily on next use.
+
+        Args:
+            size (int, optional): Number of entries shown.
+            capacity (int, optional): Number of entries tracked per guild.
+            maxGuilds (int, optional): Number of guild boards kept in memory.
+        """
+        self.size = size
+        self.capacity = capacity
+        self.maxGuilds = maxGuilds
+        self.boards = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, guild_id: int):
+        """
+        Returns the board of a guild, or None if it has to be rebuilt.
+        """
+        board = self.boards.get(guild_id)
+        if board is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.boards.move_to_end(guild_id)
+        return board
+
+    def load(self, guild_id: int, rows: list) -> Board:
+        """
+        Builds the board of a guild from rows of (key, user_id, user_name), highest key first.
+
+        Args:
+            guild_id (int): The guild ID.
+            rows (list): Up to capacity rows ordered by key descending.
+        """
+        board = Board([list(row) for row in rows[:self.capacity]],
+                      len(rows) < self.capacity)
+        self.boards[guild_id] = board
+        self.boards.move_to_end(guild_id)
+        while len(self.boards) > self.maxGuilds:
+            self.boards.popitem(last=False)
+        return board
+
+    def top(self, guild_id: int) -> list:
+        board = self.boards.get(guild_id)
+        return board.entries[:self.size] if board else []
+
+    def update(self, guild_id: int, user_id: int, user_name: str, key) -> None:
+        """
+        Records a new score for a member. Does nothing for guilds that are not loaded.
+        """
+        board = self.boards.get(guild_id)
+        if board is None:
+            return
+        entries = board.entries
+        # Every untracked member scores at most the lowest tracked entry
+        floor = entries[-1][0] if entries else None
+        index = self._find(entries, user_id)
+        if index is not None:
+            if entries[index][0] == key:
+                return
+            user_name = user_name or entries[index][2]
+            del entries[index]
+            changed = index < self.size
+        else:
+            changed = False
+
+        if board.complete or (floor is not None and key >= floor):
+            position = len(entries)
+            for i, entry in enumerate(entries):
+                if key > entry[0]:
+                    position = i
+                    break
+            entries.insert(position, [key, user_id, user_name])
+            changed = changed or position < self.size
+            if len(entries) > self.capacity:
+                entries.pop()
+                board.complete = False
+
+        if changed:
+            board.rendered = None
+        if len(entries) < self.size and not board.complete:
+            del self.boards[guild_id]
+
+    def remove(self, guild_id: int, user_id: int) -> None:
+        """
+        Removes a member that left the guild.
+        """
+        board = self.boards.get(guild_id)
+        if board is None:
+            return
+        index = self._find(board.entries, user_id)
+        if index is None:
+            return
+        del board.entries[index]
+        if index < self.size:
+            board.rendered = None
+        if len(board.entries) < self.size and not board.complete:
+            del self.boards[guild_id]
+
+    def stats(self) -> dict:
+        return {
+            "guilds": len(self.boards),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def _find(self, entries: list, user_id: int):
+        for i, entry in enumerate(entries):
+            if entry[1] == user_id:
+                return i
+        return None
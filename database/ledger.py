@@ -0,0 +1,187 @@
+"""
+Economy ledger queries, run on the storage thread.
+
+Every balance change is appended to economy_ledger instead of rewriting economy.balance.
+The balance column is a snapshot: a member's balance is the snapshot plus the deltas of
+their ledger rows newer than the checkpoint. compact() periodically folds those rows into
+the snapshots, advances the checkpoint and prunes history older than the retention window.
+"""
+import sqlite3
+import time
+
+
+def _checkpoint(connection: sqlite3.Connection) -> int:
+    return connection.execute("SELECT ledger_id FROM ledger_checkpoint").fetchone()[0]
+
+
+def _append(connection: sqlite3.Connection, guild_id: int, user_id: int, delta: int, reason: str) -> None:
+    connection.execute("INSERT INTO economy_ledger (guild_id, user_id, delta, reason, created_at) VALUES (?, ?, ?, ?, ?)",
+                       (guild_id, user_id, delta, reason, time.time()))
+
+
+def balance(connection: sqlite3.Connection, guild_id: int, user_id: int):
+    """
+    Returns the current balance of a member, or None if the member has no account.
+    """
+    row = connection.execute("""SELECT balance + COALESCE((
+        SELECT SUM(delta) FROM economy_ledger WHERE guild_id = ? AND user_id = ? AND id > ?), 0)
+        FROM economy WHERE guild_id = ? AND user_id = ?""",
+                             (guild_id, user_id, _checkpoint(connection), guild_id, user_id)).fetchone()
+    return row[0] if row else None
+
+
+def adjust(connection: sqlite3.Connection, guild_id: int, user_id: int, delta: int, required: int, reason: str):
+    """
+    Appends delta if the member's balance is at least required.
+
+    Returns:
+        int: The new balance, or None if the balance is too low or the member has no account.
+    """
+    current = balance(connection, guild_id, user_id)
+    if current is None or current < required:
+        return None
+    _append(connection, guild_id, user_id, delta, reason)
+    return current + delta
+
+
+def transfer(connection: sqlite3.Connection, guild_id: int, sender_id: int, receiver_id: int, amount: int):
+    """
+    Moves coins between two members.
+
+    Raises:
+        LookupError: The receiver has no account.
+
+    Returns:
+        tuple: The new (sender, receiver) balances, or None if the sender has too few coins.
+    """
+    receiver = balance(connection, guild_id, receiver_id)
+    if receiver is None:
+        raise LookupError(f"User {receiver_id} has no account.")
+    if sender_id == receiver_id:
+        # Paying yourself changes nothing, so nothing is recorded
+        return (receiver, receiver) if receiver >= amount else None
+    sender = adjust(connection, guild_id, sender_id, -amount, amount, "pay")
+    if sender is None:
+        return None
+    _append(connection, guild_id, receiver_id, amount, "pay")
+    return sender, receiver + amount
+
+
+def claim_daily(connection: sqlite3.Connection, guild_id: int, user_id: int, reward: int, today: str):
+    """
+    Grants the daily reward unless it was already claimed on or after today.
+
+    Raises:
+        LookupError: The member has no account.
+
+    Returns:
+        int: The new balance, or None if the reward was already claimed.
+    """
+    current = balance(connection, guild_id, user_id)
+    if current is None:
+        raise LookupError(f"User {user_id} has no account.")
+    claimed = connection.execute("""UPDATE economy SET last_daily = ? WHERE guild_id = ? AND user_id = ?
+        AND (last_daily IS NULL OR last_daily = 'NULL' OR last_daily < ?)""", (today, guild_id, user_id, today)).rowcount
+    if not claimed:
+        return None
+    _append(connection, guild_id, user_id, reward, "daily")
+    return current + reward
+
+
+def open_account(connection: sqlite3.Connection, guild_id: int, user_id: int, user_name: str, startingBalance: int) -> bool:
+    """
+    Creates an empty account and appends the starting balance to the ledger.
+
+    A member who left and rejoins before compaction still has un-compacted rows, so the
+    snapshot starts at their negated sum.
+
+    Returns:
+        bool: False if the member already had an account.
+    """
+    created = connection.execute("""INSERT OR IGNORE INTO economy (guild_id, user_id, user_name, balance) VALUES (?, ?, ?, -COALESCE((
+        SELECT SUM(delta) FROM economy_ledger WHERE guild_id = ? AND user_id = ? AND id > ?), 0))""",
+                                 (guild_id, user_id, user_name, guild_id, user_id, _checkpoint(connection))).rowcount
+    if created:
+        _append(connection, guild_id, user_id, startingBalance, "join")
+    return bool(created)
+
+
+def open_accounts(connection: sqlite3.Connection, guild_id: int, members: list, startingBalance: int) -> int:
+    """
+    Opens the accounts of the (user_id, user_name) members of a guild that have none, like open_account.
+
+    Returns:
+        int: The number of accounts opened.
+    """
+    known = {row[0] for row in connection.execute(
+        f"SELECT user_id FROM economy WHERE guild_id = ? AND user_id IN ({', '.join('?' * len(members))})",
+        (guild_id, *(user_id for user_id, _ in members)))}
+    return sum(open_account(connection, guild_id, user_id, user_name, startingBalance)
+               for user_id, user_name in members if user_id not in known)
+
+
+def close_account(connection: sqlite3.Connection, guild_id: int, user_id: int) -> None:
+    """
+    Deletes an account, appending a row that takes its remaining balance out of the economy.
+
+    The member's ledger rows are kept, so every transfer they were part of stays auditable
+    from both sides. compact() folds rows of closed accounts into no snapshot.
+    """
+    current = balance(connection, guild_id, user_id)
+    if current is None:
+        return
+    if current:
+        _append(connection, guild_id, user_id, -current, "leave")
+    connection.execute(
+        "DELETE FROM economy WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+
+
+def top(connection: sqlite3.Connection, guild_id: int, limit: int) -> list:
+    """
+    Returns the (balance, user_id, user_name) rows of the richest members, highest first.
+
+    Only members with un-compacted rows can differ from their snapshot, so the snapshot
+    top (limit + number of such members) always contains the true top limit.
+    """
+    # The unary + keeps SQLite on the rowid range, which only covers the un-compacted tail
+    tail = dict(connection.execute("SELECT user_id, SUM(delta) FROM economy_ledger WHERE id > ? AND +guild_id = ? GROUP BY user_id",
+                                   (_checkpoint(connection), guild_id)))
+    rows = {row[1]: row for row in connection.execute(
+        "SELECT balance, user_id, user_name FROM economy WHERE guild_id = ? ORDER BY balance DESC LIMIT ?", (guild_id, limit + len(tail)))}
+    for user_id in tail.keys() - rows.keys():
+        row = connection.execute(
+            "SELECT balance, user_id, user_name FROM economy WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)).fetchone()
+        if row:
+            rows[user_id] = row
+    merged = [(row[0] + tail.get(row[1], 0), row[1], row[2])
+              for row in rows.values()]
+    merged.sort(key=lambda row: row[0], reverse=True)
+    return merged[:limit]
+
+
+def compact(connection: sqlite3.Connection, retention: float) -> tuple:
+    """
+    Folds the un-compacted ledger rows into the balance snapshots and prunes old history.
+
+    Args:
+        retention (float): Seconds of compacted history to keep.
+
+    Returns:
+        tuple: The number of (folded, pruned) rows.
+    """
+    checkpoint = _checkpoint(connection)
+    last = connection.execute(
+        "SELECT MAX(id) FROM economy_ledger").fetchone()[0] or checkpoint
+    folded = 0
+    if last > checkpoint:
+        sums = connection.execute("SELECT SUM(delta), COUNT(*), guild_id, user_id FROM economy_ledger WHERE id > ? AND id <= ? GROUP BY guild_id, user_id",
+                                  (checkpoint, last)).fetchall()
+        # Rows of closed accounts match no snapshot; they stay until they age out of retention
+        connection.executemany("UPDATE economy SET balance = balance + ? WHERE guild_id = ? AND user_id = ?",
+                               [(row[0], row[2], row[3]) for row in sums])
+        connection.execute(
+            "UPDATE ledger_checkpoint SET ledger_id = ?", (last,))
+        folded = sum(row[1] for row in sums)
+    pruned = connection.execute("DELETE FROM economy_ledger WHERE id <= ? AND created_at < ?",
+                                (last, time.time() - retention)).rowcount
+    return folded, pruned
@@ -0,0 +1,137 @@
+import sqlite3
+
+# Per-connection settings, applied every time the database is opened
+PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # KiB
+    "mmap_size": 268435456,  # Bytes
+    "temp_store": "MEMORY",
+}
+
+
+def _enableWAL(connection: sqlite3.Connection) -> None:
+    # journal_mode cannot change inside a transaction, so this step runs on its own
+    connection.execute("PRAGMA journal_mode = WAL")
+
+
+# Ordered schema migrations. Version N is reached by applying MIGRATIONS[N - 1], which is
+# either a list of SQL statements (run in one transaction) or a function of the connection.
+MIGRATIONS = [
+    # 1: Tables previously created by the Economy and Levels cogs
+    [
+        """CREATE TABLE IF NOT EXISTS ECONOMY (
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        user_name TEXT NOT NULL,
+        balance INTEGER NOT NULL,
+        last_daily DATE,
+        UNIQUE(guild_id, user_id));""",
+        """CREATE TABLE IF NOT EXISTS LEVELS (
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        user_name TEXT NOT NULL,
+        experience INTEGER NOT NULL,
+        current_lvl INTEGER NOT NULL,
+        UNIQUE(guild_id, user_id));""",
+    ],
+    # 2: Leaderboard and rank indexes
+    [
+        "CREATE INDEX IF NOT EXISTS economy_leaderboard ON economy (guild_id, balance, user_name)",
+        "CREATE INDEX IF NOT EXISTS levels_rank ON levels (guild_id, current_lvl, experience, user_id)",
+    ],
+    # 3: Write-ahead logging
+    _enableWAL,
+    # 4: Append-only economy ledger, folded into economy.balance up to the checkpoint.
+    # AUTOINCREMENT keeps ids from being reused once old rows are pruned.
+    [
+        """CREATE TABLE IF NOT EXISTS economy_ledger (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        guild_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        delta INTEGER NOT NULL,
+        reason TEXT NOT NULL,
+        created_at REAL NOT NULL);""",
+        "CREATE INDEX IF NOT EXISTS economy_ledger_user ON economy_ledger (guild_id, user_id, id)",
+        """CREATE TABLE IF NOT EXISTS ledger_checkpoint (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        ledger_id INTEGER NOT NULL);""",
+        "INSERT OR IGNORE INTO ledger_checkpoint (id, ledger_id) VALUES (0, 0)",
+    ],
+    # 5: YouTube search results keyed by normalized query, evicted by last use
+    [
+        """CREATE TABLE IF NOT EXISTS search_cache (
+        query TEXT PRIMARY KEY,
+        results TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        used_at REAL NOT NULL) WITHOUT ROWID;""",
+        "CREATE INDEX IF NOT EXISTS search_cache_used ON search_cache (used_at)",
+    ],
+    # 6: Index of audio files downloaded into the local audio cache
+    [
+        """CREATE TABLE IF NOT EXISTS audio_cache (
+        video_id TEXT PRIMARY KEY,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        plays INTEGER NOT NULL,
+        last_played REAL NOT NULL) WITHOUT ROWID;""",
+    ],
+    # 7: Warm-restart snapshots of music queues, stored as space-separated video IDs,
+    # and the metadata of queued tracks, evicted by save time
+    [
+        """CREATE TABLE IF NOT EXISTS music_queues (
+        guild_id INTEGER PRIMARY KEY,
+        tracks TEXT NOT NULL,
+        played INTEGER NOT NULL,
+        current INTEGER NOT NULL,
+        saved_at REAL NOT NULL);""",
+        """CREATE TABLE IF NOT EXISTS music_tracks (
+        video_id TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        artist TEXT NOT NULL,
+        saved_at REAL NOT NULL) WITHOUT ROWID;""",
+        "CREATE INDEX IF NOT EXISTS music_tracks_saved ON music_tracks (saved_at)",
+    ],
+]
+
+
+def configure(connection: sqlite3.Connection) -> None:
+    """
+    Applies the per-connection PRAGMAS.
+
+    Args:
+        connection (sqlite3.Connection): A connection in autocommit mode.
+    """
+    for name, value in PRAGMAS.items():
+        connection.execute(f"PRAGMA {name} = {value}")
+
+
+def migrate(connection: sqlite3.Connection) -> int:
+    """
+    Upgrades the database to the latest schema version in place.
+
+    The current version is kept in PRAGMA user_version, so only the migrations that have
+    not been applied yet run. Each migration commits together with its version bump.
+
+    Args:
+        connection (sqlite3.Connection): A connection in autocommit mode.
+
+    Returns:
+        int: The schema version after migrating.
+    """
+    version = connection.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in enumerate(MIGRATIONS[version:], version + 1):
+        if callable(migration):
+            migration(connection)
+            connection.execute(f"PRAGMA user_version = {target}")
+        else:
+            connection.execute("BEGIN")
+            try:
+                for statement in migration:
+                    connection.execute(statement)
+                connection.execute(f"PRAGMA user_version = {target}")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        print(f"Database migrated to version {target}.")
+    return len(MIGRATIONS)
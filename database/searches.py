@@ -0,0 +1,37 @@
+"""
+Search result cache queries, run on the storage thread.
+
+Results are stored as JSON under their normalized query. Lookups refresh used_at, and
+store() evicts the least recently used rows once the table holds more than maxEntries.
+"""
+import json
+import sqlite3
+import time
+
+
+def lookup(connection: sqlite3.Connection, query: str, maxAge: float):
+    """
+    Returns the (created_at, results) of a cached query, or None if it is missing or older than maxAge seconds.
+    """
+    row = connection.execute(
+        "SELECT results, created_at FROM search_cache WHERE query = ?", (query,)).fetchone()
+    now = time.time()
+    if row is None or row[1] < now - maxAge:
+        return None
+    connection.execute(
+        "UPDATE search_cache SET used_at = ? WHERE query = ?", (now, query))
+    return row[1], json.loads(row[0])
+
+
+def store(connection: sqlite3.Connection, query: str, results: list, maxEntries: int) -> int:
+    """
+    Caches the results of a query and evicts the least recently used entries beyond maxEntries.
+
+    Returns:
+        int: The number of evicted entries.
+    """
+    now = time.time()
+    connection.execute("INSERT OR REPLACE INTO search_cache (query, results, created_at, used_at) VALUES (?, ?, ?, ?)",
+                       (query, json.dumps(results, separators=(",", ":")), now, now))
+    return connection.execute("""DELETE FROM search_cache WHERE used_at <= (
+        SELECT used_at FROM search_cache ORDER BY used_at DESC LIMIT 1 OFFSET ?)""", (maxEntries,)).rowcount
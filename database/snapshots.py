@@ -0,0 +1,71 @@
+"""
+Music queue snapshot queries, run on the storage thread.
+
+A queue is one row holding the video IDs of its history, current track and upcoming
+tracks in order, separated by spaces. Titles and artists live once per video in
+music_tracks, which save() trims to the maxTracks most recently saved videos.
+"""
+import sqlite3
+import time
+
+# Maximum number of host parameters per IN (...) lookup
+LOOKUP_CHUNK = 500
+
+
+def guilds(connection: sqlite3.Connection) -> list:
+    """
+    Returns the IDs of the guilds that have a saved queue.
+    """
+    return [row[0] for row in connection.execute("SELECT guild_id FROM music_queues")]
+
+
+def load(connection: sqlite3.Connection, guild_id: int):
+    """
+    Returns the (video_ids, played, current) of a guild's saved queue, or None.
+    """
+    row = connection.execute(
+        "SELECT tracks, played, current FROM music_queues WHERE guild_id = ?", (guild_id,)).fetchone()
+    if row is None:
+        return None
+    return row[0].split(), row[1], bool(row[2])
+
+
+def tracks(connection: sqlite3.Connection, video_ids: list) -> dict:
+    """
+    Returns video ID -> (title, artist) for the saved videos among video_ids.
+    """
+    found = {}
+    video_ids = list(dict.fromkeys(video_ids))
+    for start in range(0, len(video_ids), LOOKUP_CHUNK):
+        chunk = video_ids[start:start + LOOKUP_CHUNK]
+        for video_id, title, artist in connection.execute(
+                f"SELECT video_id, title, artist FROM music_tracks WHERE video_id IN ({','.join('?' * len(chunk))})", chunk):
+            found[video_id] = (title, artist)
+    return found
+
+
+def save(connection: sqlite3.Connection, queues: list, deleted: list, tracks: list, maxTracks: int) -> int:
+    """
+    Writes changed queues and newly queued tracks in one go.
+
+    Args:
+        connection (sqlite3.Connection): The storage connection.
+        queues (list): (guild_id, tracks, played, current) rows to replace.
+        deleted (list): IDs of guilds whose queue is now empty.
+        tracks (list): (video_id, title, artist) rows to add.
+        maxTracks (int): Maximum number of saved videos.
+
+    Returns:
+        int: The number of evicted videos.
+    """
+    now = time.time()
+    connection.executemany("INSERT OR REPLACE INTO music_queues (guild_id, tracks, played, current, saved_at) VALUES (?, ?, ?, ?, ?)",
+                           [(*row, now) for row in queues])
+    connection.executemany(
+        "DELETE FROM music_queues WHERE guild_id = ?", [(guild_id,) for guild_id in deleted])
+    connection.executemany("INSERT OR REPLACE INTO music_tracks (video_id, title, artist, saved_at) VALUES (?, ?, ?, ?)",
+                           [(*row, now) for row in tracks])
+    if not tracks:
+        return 0
+    return connection.execute("""DELETE FROM music_tracks WHERE saved_at < (
+        SELECT saved_at FROM music_tracks ORDER BY saved_at DESC LIMIT 1 OFFSET ?)""", (maxTracks,)).rowcount
@@ -0,0 +1,428 @@
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+from . import ledger, migrations, searches, snapshots
+from .cache import MISSING, ProfileCache
+
+# Maximum number of queued requests executed (and committed) together
+BATCH_SIZE = 256
+# Members whose accounts are opened per request by open_accounts, below SQLite's
+# default limit of 999 parameters per statement
+ACCOUNT_BATCH = 500
+
+
+class Storage:
+    def __init__(self, path: str, batchSize: int = BATCH_SIZE, cache: ProfileCache = None) -> None:
+        """
+        Asynchronous data-access layer for the bot's SQLite database.
+
+        All queries run on one dedicated thread that owns the connection, so the event
+        loop never blocks on disk I/O. Requests that queue up while the thread is busy
+        are executed as a batch and their writes share a single transaction.
+
+        Balance and level reads are served from a shared profile cache that every
+        write through this class keeps up to date.
+
+        Args:
+            path (str): Path to the SQLite database file.
+            batchSize (int, optional): Maximum number of requests per batch.
+            cache (database.cache.ProfileCache, optional): Cache for user profiles.
+        """
+        self.path = path
+        self.batchSize = batchSize
+        self.cache = cache if cache is not None else ProfileCache()
+        self._requests = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name="storage", daemon=True)
+
+        # Counters exposed through stats()
+        self.requestCount = 0
+        self.batchCount = 0
+        self.commitCount = 0
+        self.largestBatch = 0
+        self.queueWait = 0.0
+        self.busyTime = 0.0
+
+    async def start(self) -> None:
+        """
+        Starts the database thread and migrates the schema to the latest version.
+        """
+        self._thread.start()
+        await self.run(migrations.migrate, write=False)
+
+    def close(self) -> None:
+        """
+        Finishes every queued request, then stops the database thread and closes the connection.
+        """
+        if self._thread.is_alive():
+            self._requests.put(None)
+            self._thread.join()
+
+    def stats(self) -> dict:
+        """
+        Returns counters describing the load on the database thread.
+        """
+        return {
+            "requests": self.requestCount,
+            "batches": self.batchCount,
+            "commits": self.commitCount,
+            "largest batch": self.largestBatch,
+            "queued": self._requests.qsize(),
+            "avg wait (ms)": round(self.queueWait / max(self.requestCount, 1) * 1000, 3),
+            "avg batch time (ms)": round(self.busyTime / max(self.batchCount, 1) * 1000, 3),
+            **self.cache.stats(),
+        }
+
+    async def run(self, func, *args, write: bool = True):
+        """
+        Runs func(connection, *args) on the database thread and returns its result.
+
+        Write requests run inside a savepoint of the batch transaction, so a failing
+        request is rolled back without affecting the others in its batch.
+
+        Args:
+            func (callable): Function receiving the connection followed by args.
+            write (bool, optional): Whether func modifies the database.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._requests.put((func, args, write, future, loop, time.perf_counter()))
+        return await future
+
+    async def execute(self, sql: str, params=()) -> int:
+        """
+        Executes a single write statement and returns the number of changed rows.
+        """
+        return await self.run(_execute, sql, params)
+
+    async def executemany(self, sql: str, rows) -> int:
+        """
+        Executes a write statement for every row in one transaction and returns the number of changed rows.
+        """
+        return await self.run(_executemany, sql, list(rows))
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(_fetchone, sql, params, write=False)
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        return await self.run(_fetchall, sql, params, write=False)
+
+    async def add_members(self, table: str, columns: tuple, guild_id: int, rows: list) -> int:
+        """
+        Inserts the member rows of one guild that are not stored yet, in a single transaction.
+
+        Every row must start with (guild_id, user_id, ...) matching columns. The stored
+        user ids are diffed on the database thread, so only new members are written.
+
+        Args:
+            table (str): Table to insert into.
+            columns (tuple): Column names of each row.
+            guild_id (int): The guild the rows belong to.
+            rows (list): Rows to insert.
+
+        Returns:
+            int: The number of inserted rows.
+        """
+        return await self.run(_addMembers, table, columns, guild_id, rows)
+
+    async def get_balance(self, guild_id: int, user_id: int):
+        """
+        Returns the snapshot balance plus the un-compacted ledger tail, or None for unknown users.
+        """
+        balance = self.cache.get(guild_id, user_id, "balance")
+        if balance is MISSING:
+            balance = await self.run(ledger.balance, guild_id, user_id, write=False)
+            if balance is not None:
+                self.cache.put(guild_id, user_id, balance=balance)
+        return balance
+
+    async def adjust_balance(self, guild_id: int, user_id: int, delta: int, required: int = 0, reason: str = "adjust"):
+        """
+        Appends delta to the ledger if the balance is at least required.
+
+        The check and the append happen in one request on the database thread, so no
+        concurrent change can slip in between them.
+
+        Returns:
+            int: The new balance, or None if the balance is too low or the user is unknown.
+        """
+        return self._cacheBalance(guild_id, user_id, await self.run(ledger.adjust, guild_id, user_id, delta, required, reason))
+
+    async def transfer(self, guild_id: int, sender_id: int, receiver_id: int, amount: int):
+        """
+        Atomically moves coins from one member to another.
+
+        The balance check and both ledger appends run in one transaction, so concurrent
+        transfers can neither lose an update nor overdraw the sender.
+
+        Raises:
+            LookupError: The receiver has no account.
+
+        Returns:
+            tuple: The new (sender, receiver) balances, or None if the sender has too few coins.
+        """
+        balances = await self.run(ledger.transfer, guild_id, sender_id, receiver_id, amount)
+        if balances is not None:
+            self._cacheBalance(guild_id, sender_id, balances[0])
+            self._cacheBalance(guild_id, receiver_id, balances[1])
+        return balances
+
+    async def claim_daily(self, guild_id: int, user_id: int, reward: int, today: str):
+        """
+        Grants a daily reward at most once per day.
+
+        Raises:
+            LookupError: The user has no account.
+
+        Returns:
+            int: The new balance, or None if today's reward was already claimed.
+        """
+        return self._cacheBalance(guild_id, user_id, await self.run(ledger.claim_daily, guild_id, user_id, reward, today))
+
+    async def open_account(self, guild_id: int, user_id: int, user_name: str, balance: int) -> bool:
+        created = await self.run(ledger.open_account, guild_id, user_id, user_name, balance)
+        if created:
+            self._cacheBalance(guild_id, user_id, balance)
+        return created
+
+    async def open_accounts(self, guild_id: int, members: list, balance: int) -> int:
+        """
+        Opens accounts for the (user_id, user_name) members of a guild that have none.
+
+        Every account is opened the way open_account opens it, with a "join" ledger row.
+        Members are sent in requests of ACCOUNT_BATCH, so a large guild does not hold
+        up other requests on the database thread for the whole backfill.
+
+        Returns:
+            int: The number of accounts opened.
+        """
+        opened = 0
+        for start in range(0, len(members), ACCOUNT_BATCH):
+            opened += await self.run(ledger.open_accounts, guild_id, members[start:start + ACCOUNT_BATCH], balance)
+        return opened
+
+    async def close_account(self, guild_id: int, user_id: int) -> None:
+        self.cache.invalidate(guild_id, user_id)
+        await self.run(ledger.close_account, guild_id, user_id)
+        self.cache.invalidate(guild_id, user_id)
+
+    async def get_leaderboard(self, guild_id: int, limit: int) -> list:
+        """
+        Returns the (balance, user_id, user_name) rows of the richest members of a guild.
+        """
+        return await self.run(ledger.top, guild_id, limit, write=False)
+
+    async def compact_ledger(self, retention: float) -> tuple:
+        """
+        Folds the ledger tail into the balance snapshots and prunes history older than retention seconds.
+
+        Returns:
+            tuple: The number of (folded, pruned) ledger rows.
+        """
+        return await self.run(ledger.compact, retention)
+
+    async def get_level(self, guild_id: int, user_id: int):
+        """
+        Returns a (level, experience) tuple for a user, or None if the user is unknown.
+        """
+        level = self.cache.get(guild_id, user_id, "level")
+        if level is not MISSING:
+            return level, self.cache.get(guild_id, user_id, "experience")
+        row = await self.fetchone(
+            "SELECT current_lvl, experience FROM levels WHERE user_id = ? AND guild_id = ?", (user_id, guild_id))
+        if row is None:
+            return None
+        self.cache.put(guild_id, user_id, level=row[0], experience=row[1])
+        return tuple(row)
+
+    async def get_rank(self, guild_id: int, level: int, experience: int) -> int:
+        """
+        Returns the rank of a (level, experience) score within a guild.
+
+        The rank is one more than the number of members ranked strictly higher. The row
+        value comparison lets SQLite count a range of the levels_rank covering index
+        without reading any table rows.
+        """
+        row = await self.fetchone(
+            "SELECT COUNT(*) FROM levels WHERE guild_id = ? AND (current_lvl, experience) > (?, ?)", (guild_id, level, experience))
+        return row[0] + 1
+
+    async def set_levels(self, rows) -> None:
+        """
+        Writes many (level, experience, guild_id, user_id) rows in one transaction.
+
+        Only rows that still exist when the write runs are cached, so a flush racing
+        delete_levels cannot put a removed member's old level back into the cache.
+        """
+        for level, experience, guild_id, user_id in await self.run(_setLevels, list(rows)):
+            self.cache.put(guild_id, user_id, level=level,
+                           experience=experience)
+
+    async def delete_levels(self, guild_id: int, user_id: int) -> None:
+        """
+        Deletes a member's level row. Invalidating again afterwards drops the entry of a
+        set_levels request that ran just before the delete; its results are delivered first.
+        """
+        self.cache.invalidate(guild_id, user_id)
+        await self.execute(
+            "DELETE FROM levels WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        self.cache.invalidate(guild_id, user_id)
+
+    async def get_search_results(self, query: str, ttl: float):
+        """
+        Returns the (created_at, results) of a cached normalized search query, or None if it is missing or expired.
+        """
+        return await self.run(searches.lookup, query, ttl)
+
+    async def put_search_results(self, query: str, results: list, maxEntries: int) -> int:
+        """
+        Caches the results of a normalized search query, keeping at most maxEntries queries.
+
+        Returns:
+            int: The number of evicted queries.
+        """
+        return await self.run(searches.store, query, results, maxEntries)
+
+    async def get_queue_guilds(self) -> list:
+        """
+        Returns the IDs of the guilds with a saved music queue.
+        """
+        return await self.run(snapshots.guilds, write=False)
+
+    async def get_queue(self, guild_id: int):
+        """
+        Returns the (video_ids, played, current) of a guild's saved music queue, or None.
+        """
+        return await self.run(snapshots.load, guild_id, write=False)
+
+    async def get_tracks(self, video_ids: list) -> dict:
+        """
+        Returns video ID -> (title, artist) for the saved videos among video_ids.
+        """
+        return await self.run(snapshots.tracks, video_ids, write=False)
+
+    async def save_queues(self, queues: list, deleted: list, tracks: list, maxTracks: int) -> int:
+        """
+        Replaces changed music queues, deletes emptied ones and saves the metadata of new tracks.
+
+        Returns:
+            int: The number of videos evicted to stay within maxTracks.
+        """
+        return await self.run(snapshots.save, queues, deleted, tracks, maxTracks)
+
+    def _cacheBalance(self, guild_id: int, user_id: int, balance):
+        if balance is not None:
+            self.cache.put(guild_id, user_id, balance=balance)
+        return balance
+
+    def _run(self) -> None:
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        migrations.configure(connection)
+        stopping = False
+        while not stopping:
+            request = self._requests.get()
+            if request is None:
+                break
+            batch = [request]
+            while len(batch) < self.batchSize:
+                try:
+                    request = self._requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            try:
+                self._execute(connection, batch)
+            except Exception as e:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                for _, _, _, future, loop, _ in batch:
+                    loop.call_soon_threadsafe(_resolve, future, None, e)
+        connection.close()
+
+    def _execute(self, connection: sqlite3.Connection, batch: list) -> None:
+        started = time.perf_counter()
+        writes = any(request[2] for request in batch)
+        results = []
+        if writes:
+            connection.execute("BEGIN")
+        for func, args, write, future, loop, queued in batch:
+            self.queueWait += started - queued
+            if write:
+                connection.execute("SAVEPOINT request")
+            try:
+                result = func(connection, *args)
+            except Exception as e:
+                if write:
+                    connection.execute("ROLLBACK TO request")
+                    connection.execute("RELEASE request")
+                results.append((future, loop, None, e))
+                continue
+            if write:
+                connection.execute("RELEASE request")
+            results.append((future, loop, result, None))
+        if writes:
+            try:
+                connection.execute("COMMIT")
+                self.commitCount += 1
+            except sqlite3.Error as e:
+                if connection.in_transaction:
+                    connection.execute("ROLLBACK")
+                results = [(future, loop, None, e)
+                           for future, loop, _, _ in results]
+
+        self.requestCount += len(batch)
+        self.batchCount += 1
+        self.largestBatch = max(self.largestBatch, len(batch))
+        self.busyTime += time.perf_counter() - started
+        for future, loop, result, error in results:
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+
+
+def _resolve(future: asyncio.Future, result, error) -> None:
+    if future.cancelled():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+
+
+def _addMembers(connection: sqlite3.Connection, table: str, columns: tuple, guild_id: int, rows: list) -> int:
+    known = {row[0] for row in connection.execute(
+        f"SELECT user_id FROM {table} WHERE guild_id = ?", (guild_id,))}
+    missing = [row for row in rows if row[1] not in known]
+    if not missing:
+        return 0
+    placeholders = ", ".join("?" * len(columns))
+    connection.executemany(
+        f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", missing)
+    return len(missing)
+
+
+def _setLevels(connection: sqlite3.Connection, rows: list) -> list:
+    """
+    Updates the level rows and returns the ones that matched a stored member.
+    """
+    return [row for row in rows if connection.execute(
+        "UPDATE levels SET current_lvl = ?, experience = ? WHERE guild_id = ? AND user_id = ?", row).rowcount]
+
+
+def _execute(connection: sqlite3.Connection, sql: str, params) -> int:
+    return connection.execute(sql, params).rowcount
+
+
+def _executemany(connection: sqlite3.Connection, sql: str, rows: list) -> int:
+    return connection.executemany(sql, rows).rowcount
+
+
+def _fetchone(connection: sqlite3.Connection, sql: str, params):
+    return connection.execute(sql, params).fetchone()
+
+
+def _fetchall(connection: sqlite3.Connection, sql: str, params) -> list:
+    return connection.execute(sql, params).fetchall()
@@ -1,10 +1,9 @@
 import discord
 from discord.ext import commands
-import asyncio
 from cogs import utility, admin, music, economy, levels
 from dotenv import load_dotenv
 from os import getenv
-import sqlite3
+from database import Storage
 
 load_dotenv()
 
@@ -14,7 +13,7 @@ intents = discord.Intents.default()
 intents.members = True
 intents.message_content = True
 bot = commands.Bot(command_prefix='!', intents=intents)
-dbConnection = sqlite3.connect('database.db')
+storage = Storage('database.db')
 
 
 @bot.event
@@ -24,13 +23,15 @@ async def on_ready():
     print("Slash Commands synced.")
 
 
-async def main():
-    await bot.add_cog(admin.Admin(bot))
+@bot.event
+async def setup_hook():
+    # Cogs are added inside the bot's own event loop so their background tasks keep running
+    await storage.start()
+    await bot.add_cog(admin.Admin(bot, storage))
     await bot.add_cog(utility.Utility(bot))
-    await bot.add_cog(music.Music(bot))
-    await bot.add_cog(economy.Economy(bot, dbConnection))
-    await bot.add_cog(levels.Levels(bot, dbConnection))
-
-asyncio.run(main())
+    await bot.add_cog(music.Music(bot, storage))
+    await bot.add_cog(economy.Economy(bot, storage))
+    await bot.add_cog(levels.Levels(bot, storage))
 
 bot.run(TOKEN)
+storage.close()